@@ -1,54 +1,325 @@
 import csv
 import xml.etree.ElementTree as ET
 import argparse
+import functools
+import hashlib
+import json
+import multiprocessing
 import os
 import logging
+import shutil
+
+from portscan import iter_ports
 
 logging.basicConfig(level=logging.INFO)
 
-def get_all_files(directory):
+# buffer size of the output CSV file
+BUFFER_SIZE = 1024 * 1024
+
+# Version of the incremental mode manifest, other versions are discarded
+MANIFEST_VERSION = 1
+
+def get_all_files(directory, extensions=(".xml",)):
     """
     Recursively get all files in a directory and its sub-directories.
-    
+    The directories are scanned lazily, in the same order as os.walk, and
+    those which cannot be read are logged and skipped.
+
     Args:
         directory (str): The path to the directory.
-    
+        extensions (tuple of str): The extensions of the files to get.
+
+    Returns:
+        generator: The paths to all XML files in the directory and its sub-directories.
+    """
+    files = []
+    sub_directories = []
+    # like os.walk, unreadable directories are skipped
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError as e:
+                    logging.warning(f'Skipping {entry.path}: {e}')
+                    continue
+                if is_dir:
+                    # like os.walk, do not follow symbolic links to directories
+                    if not entry.is_symlink():
+                        sub_directories.append(entry.path)
+                elif entry.name.endswith(extensions):
+                    logging.debug(f'Found XML file: {entry.path}')
+                    files.append(entry.path)
+    except OSError as e:
+        logging.warning(f'Skipping directory {directory}: {e}')
+    yield from files
+    for sub_directory in sub_directories:
+        yield from get_all_files(sub_directory, extensions)
+
+def extract_data(xml_file, attributes):
+    for port in iter_ports(xml_file):
+        data = {attr: port.get(attr, '') for attr in attributes}
+        yield data
+
+def get_fieldnames(attributes):
+    return ['BaseName'] + attributes + ['FileName']
+
+def extract_rows(xml_file, attributes):
+    """
+    Extract the CSV rows of the ports of an XML file.
+
+    Args:
+        xml_file (str): The path to the XML file.
+        attributes (list of str): The attributes to extract.
+
+    Returns:
+        generator: One dictionary per port, see get_fieldnames.
+    """
+    base_name = os.path.basename(xml_file)
+    for data in extract_data(xml_file, attributes):
+        yield {**{'BaseName': base_name}, **data, **{'FileName': xml_file}}
+
+def extract_file(xml_file, attributes):
+    """
+    Extract the CSV rows of an XML file, without raising parsing errors.
+
+    Args:
+        xml_file (str): The path to the XML file.
+        attributes (list of str): The attributes to extract.
+
+    Returns:
+        tuple: (xml_file, list of rows, error message or None)
+    """
+    try:
+        return xml_file, list(extract_rows(xml_file, attributes)), None
+    except (ET.ParseError, OSError) as e:
+        return xml_file, [], f'{type(e).__name__}: {e}'
+
+def iter_results(xml_files, attributes, jobs=1, ordered=False):
+    """
+    Extract the CSV rows of XML files, see extract_file.
+
+    Args:
+        xml_files (iterable of str): The paths to the XML files.
+        attributes (list of str): The attributes to extract.
+        jobs (int): The number of worker processes parsing the files.
+        ordered (bool): With several jobs, keep the order of xml_files
+            instead of the order in which the files are parsed.
+
+    Returns:
+        generator: (xml_file, list of rows, error message or None)
+    """
+    if jobs <= 1:
+        for xml_file in xml_files:
+            yield extract_file(xml_file, attributes)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        extract = functools.partial(extract_file, attributes=attributes)
+        imap = pool.imap if ordered else pool.imap_unordered
+        yield from imap(extract, xml_files, chunksize=4)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def iter_rows(xml_files, attributes, jobs=1, ordered=False):
+    """
+    Extract the CSV rows of XML files, logging the progress.
+    Files which cannot be parsed are logged and skipped.
+
+    Args:
+        xml_files (iterable of str): The paths to the XML files.
+        attributes (list of str): The attributes to extract.
+        jobs (int): The number of worker processes parsing the files.
+        ordered (bool): With several jobs, keep the rows in the order of
+            xml_files instead of the order in which the files are parsed.
+
     Returns:
-        list: A list of paths to all files in the directory and its sub-directories.
-    """
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".xml"):
-                file_path = os.path.join(root, file)
-                logging.info(f'Found XML file: {file_path}')
-                yield file_path
-
-def parse_xml(file_path):
-    tree = ET.parse(file_path)
-    return tree.getroot()
-
-def extract_data(root, attributes):
-    for port in root.iter():
-        if port.tag in ["HFSamplingPort", "HFQueuingPort"]:
-            data = {attr: port.attrib.get(attr, '') for attr in attributes}
-            yield data
-
-def write_csv(base_name, file_name, data, file_path, attributes):
-    with open(file_path, 'a', newline='') as csvfile:
-        fieldnames = ['BaseName'] + attributes + ['FileName']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writerow({**{'BaseName': base_name}, **data, **{'FileName': file_name} })
-
-
-def main(xml_file, csv_file, filter_attributes):
-    root = parse_xml(xml_file)
-    data = extract_data(root, filter_attributes)
+        generator: One dictionary per port.
+    """
+    file_count = 0
+    row_count = 0
+    errors = 0
+    for xml_file, rows, error in iter_results(xml_files, attributes, jobs, ordered):
+        file_count += 1
+        if error is not None:
+            errors += 1
+            logging.error(f'Error parsing file {file_count}: {xml_file}: {error}')
+            continue
+        logging.info(f'Processed file {file_count}: {xml_file}')
+        row_count += len(rows)
+        yield from rows
+    logging.info(f'Processed {file_count} files, {row_count} ports, {errors} errors')
+
+def write_csv(rows, file_path, attributes):
+    """
+    Write rows to a CSV file through a single buffered writer.
+
+    Args:
+        rows (iterable of dict): The rows to write.
+        file_path (str): The path to the output CSV file.
+        attributes (list of str): The extracted attributes.
+    """
+    with open(file_path, 'w', newline='', buffering=BUFFER_SIZE) as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=get_fieldnames(attributes))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def file_hash(file_path):
+    """
+    Returns:
+        str: The SHA-1 hexadecimal digest of the content of a file.
+    """
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BUFFER_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class IncrementalExport(object):
+    """
+    State of the incremental mode, kept in the '<output>.d' directory next to
+    the output CSV file: a manifest of the exported XML files, with their
+    mtime, size and hash, and the block of CSV rows extracted from each file.
+    """
+
+    def __init__(self, csv_file, attributes):
+        """
+        Args:
+            csv_file (str): The path to the output CSV file.
+            attributes (list of str): The extracted attributes.
+        """
+        self.csv_file = csv_file
+        self.attributes = attributes
+        self.directory = csv_file + '.d'
+        self.manifest_file = os.path.join(self.directory, 'manifest.json')
+        # XML file path -> {"mtime_ns", "size", "hash", "block"}
+        self.files = self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION or \
+                manifest.get('attributes') != self.attributes:
+            logging.info('Manifest discarded, extracting all files')
+            return {}
+        return manifest['files']
+
+    def save_manifest(self):
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'attributes': self.attributes,
+                       'files': self.files}, f)
+        os.replace(tmp_file, self.manifest_file)
+
+    def block_path(self, entry):
+        return os.path.join(self.directory, entry['block'])
+
+    def is_unchanged(self, xml_file, stat):
+        """
+        Check an XML file against the manifest, its content is only hashed
+        when its mtime or size changed.
+
+        Returns:
+            bool: True if the block of the file is up to date.
+        """
+        entry = self.files.get(xml_file)
+        if entry is None or not os.path.exists(self.block_path(entry)):
+            return False
+        if entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return True
+        if entry['hash'] != file_hash(xml_file):
+            return False
+        entry['mtime_ns'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+        return True
+
+    def write_block(self, xml_file, stat, rows):
+        """
+        Write the rows of an XML file in its block and record it in the manifest.
+        """
+        block = hashlib.sha1(xml_file.encode('utf-8')).hexdigest() + '.csv'
+        entry = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                 'hash': file_hash(xml_file), 'block': block}
+        with open(self.block_path(entry), 'w', newline='', buffering=BUFFER_SIZE) as f:
+            writer = csv.DictWriter(f, fieldnames=get_fieldnames(self.attributes))
+            writer.writerows(rows)
+        self.files[xml_file] = entry
+
+    def remove(self, xml_file):
+        entry = self.files.pop(xml_file)
+        try:
+            os.remove(self.block_path(entry))
+        except FileNotFoundError:
+            pass
+
+    def update(self, xml_files, jobs=1):
+        """
+        Extract the new and modified XML files, forget the deleted ones and
+        rewrite the output CSV file from the blocks.
+
+        Args:
+            xml_files (iterable of str): The paths to the XML files.
+            jobs (int): The number of worker processes parsing the files.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        xml_files = list(xml_files)
+        stats = {}
+        to_extract = []
+        for xml_file in xml_files:
+            try:
+                stats[xml_file] = os.stat(xml_file)
+            except OSError as e:
+                logging.error(f'Error reading file {xml_file}: {e}')
+                continue
+            if not self.is_unchanged(xml_file, stats[xml_file]):
+                to_extract.append(xml_file)
+
+        deleted = [xml_file for xml_file in self.files if xml_file not in stats]
+        for xml_file in deleted:
+            self.remove(xml_file)
+
+        errors = 0
+        results = iter_results(to_extract, self.attributes, jobs)
+        for count, (xml_file, rows, error) in enumerate(results, 1):
+            if error is not None:
+                errors += 1
+                logging.error(f'Error parsing file {count}/{len(to_extract)}: {xml_file}: {error}')
+                if xml_file in self.files:
+                    self.remove(xml_file)
+                continue
+            logging.info(f'Processed file {count}/{len(to_extract)}: {xml_file}')
+            self.write_block(xml_file, stats[xml_file], rows)
+        self.save_manifest()
+        logging.info(f'{len(xml_files) - len(to_extract)} files unchanged, '
+                     f'{len(to_extract)} extracted, {len(deleted)} deleted, {errors} errors')
+
+        tmp_file = self.csv_file + '.tmp'
+        with open(tmp_file, 'w', newline='', buffering=BUFFER_SIZE) as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=get_fieldnames(self.attributes))
+            writer.writeheader()
+            for xml_file in xml_files:
+                entry = self.files.get(xml_file)
+                if entry is not None:
+                    with open(self.block_path(entry), newline='') as block:
+                        shutil.copyfileobj(block, csvfile)
+        os.replace(tmp_file, self.csv_file)
+
+
+def main(xml_files, csv_file, filter_attributes, jobs=1, ordered=False, incremental=False):
+    if incremental:
+        IncrementalExport(csv_file, filter_attributes).update(xml_files, jobs)
+        return
+    rows = iter_rows(xml_files, filter_attributes, jobs, ordered)
     if csv_file:
-        for d in data:
-            write_csv(os.path.basename(xml_file), xml_file, d, csv_file, filter_attributes)
+        write_csv(rows, csv_file, filter_attributes)
     else:
-        for d in data:
-            print({**{'BaseName': os.path.basename(xml_file)}, **d, **{'FileName': xml_file}})
+        for row in rows:
+            print(row)
 
 
 if __name__ == "__main__":
@@ -56,28 +327,24 @@ if __name__ == "__main__":
     parser.add_argument('-f', '--filter', required=True, help='The attributes to filter.', type=str)
     parser.add_argument('-o', '--output', help='The path to the output CSV file.')
     parser.add_argument('-d', '--directory', help='The path to a directory of XML files.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='The number of worker processes parsing the XML files.')
+    parser.add_argument('--ordered', action='store_true',
+                        help='With several jobs, write the rows in the same order as a single job.')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only extract the XML files modified since the previous run with the '
+                             'same output, see IncrementalExport.')
+    parser.add_argument('xml_files', nargs='*', help='The paths to the XML files.')
 
     args = parser.parse_args()
     args.filter = args.filter.split(',')
-    
+    if args.incremental and not args.output:
+        parser.error('--incremental requires an output CSV file')
+
     # Check if a directory was specified
     if args.directory:
-        xml_files = list(get_all_files(args.directory))
+        xml_files = get_all_files(args.directory)
     else:
         xml_files = args.xml_files
 
-    # Initialize count for progress logging
-    total_files = len(xml_files)
-    current_file = 1
-
-    if args.output:
-        # If an output file was specified, write the headers to it
-        with open(args.output, 'w', newline='') as csvfile:
-            fieldnames = ['BaseName'] + args.filter + ['FileName']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-
-    for xml_file in xml_files:
-        logging.info(f'Processing file {current_file}/{total_files}: {xml_file}')
-        current_file += 1
-        main(xml_file, args.output, args.filter)
+    main(xml_files, args.output, args.filter, args.jobs, args.ordered, args.incremental)
@@ -1,42 +1,76 @@
-import csv
-import xml.etree.ElementTree as ET
 import argparse
+import json
+import multiprocessing
+import os
 
-def parse_xml(file_path):
+from portscan import iter_ports
+
+# Version of the cache file format, other versions are discarded
+CACHE_VERSION = 1
+
+def scan_file(xml_file):
     """
-    Parse le fichier XML.
-    
+    Get the attribute names of the ports of an XML file, without building its tree.
+
     Args:
-        file_path (str): Le chemin du fichier XML à analyser.
+        xml_file (str): The path to the XML file.
+
+    Returns:
+        list of str: The sorted attribute names.
+    """
+    attribute_names = set()
+    for port in iter_ports(xml_file):
+        attribute_names.update(port.keys())
+    return sorted(attribute_names)
+
+def file_key(xml_file):
+    """
+    Get the key telling whether an XML file changed since it was scanned.
 
     Returns:
-        ElementTree.Element: La racine de l'arbre XML.
+        list: [modification time in ns, size]
     """
-    tree = ET.parse(file_path)
-    return tree.getroot()
+    stat = os.stat(xml_file)
+    return [stat.st_mtime_ns, stat.st_size]
 
-def extract_data(root):
+def load_cache(cache_file):
     """
-    A generator function that extracts the attribute names from the XML file.
+    Load the attribute names of the files scanned by previous runs.
 
     Args:
-        root (xml.etree.ElementTree.Element): The root element of the XML file.
+        cache_file (str): The path to the JSON cache file.
 
     Returns:
-        set: A set of unique attribute names.
+        dict: absolute path -> {"key": file_key, "attributes": attribute names}
     """
-    attribute_names = set()
-    for port in root.iter():
-        if port.tag in ["HFSamplingPort", "HFQueuingPort"]:
-            attribute_names.update(port.attrib.keys())
-    return attribute_names
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CACHE_VERSION:
+        return {}
+    return data["files"]
+
+def save_cache(cache_file, cache):
+    """
+    Save the cache, dropping the entries of the files which no longer exist.
+    """
+    files = {path: entry for path, entry in cache.items() if os.path.exists(path)}
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "w", encoding='utf-8') as f:
+        json.dump({"version": CACHE_VERSION, "files": files}, f)
+    os.replace(tmp_file, cache_file)
 
-def main(xml_files):
+def main(xml_files, jobs=1, cache_file=None):
     """
     La fonction principale du script.
 
     Args:
         xml_files (list of str): Les chemins des fichiers XML à traiter.
+        jobs (int): The number of worker processes scanning the files.
+        cache_file (str): The path to a JSON file keeping the attribute names
+            of each file, only the files modified since are scanned again.
 
     Returns:
         None
@@ -44,17 +78,30 @@ def main(xml_files):
     # Initialize an empty set to hold all attribute names from all files
     all_attribute_names = set()
 
-    # Loop over each XML file
+    cache = load_cache(cache_file) if cache_file else {}
+    # Files to scan, with their key taken before scanning them
+    to_scan = {}
     for xml_file in xml_files:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        # Get the attribute names from the XML file
-        attribute_names = extract_data(root)
-
-        # Add the attribute names from this file to the overall set
+        path = os.path.abspath(xml_file)
+        key = file_key(path)
+        entry = cache.get(path)
+        if entry is not None and entry["key"] == key:
+            all_attribute_names.update(entry["attributes"])
+        else:
+            to_scan[path] = key
+
+    if jobs > 1 and len(to_scan) > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            results = list(pool.imap(scan_file, to_scan, chunksize=8))
+    else:
+        results = [scan_file(path) for path in to_scan]
+
+    # Add the attribute names of the scanned files to the overall set
+    for (path, key), attribute_names in zip(to_scan.items(), results):
+        cache[path] = {"key": key, "attributes": attribute_names}
         all_attribute_names.update(attribute_names)
+    if cache_file:
+        save_cache(cache_file, cache)
 
     ordered_names=list(all_attribute_names)
     ordered_names.sort()
@@ -64,13 +111,17 @@ def main(xml_files):
 
 if __name__ == "__main__":
     # Create the argument parser
-    parser = argparse.ArgumentParser(description=extract_data.__doc__)
+    parser = argparse.ArgumentParser(
+        description='Print the attribute names of the ports of XML files.')
     parser.add_argument('xml_files', nargs='+', help='The paths to the XML files.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='The number of worker processes scanning the XML files.')
+    parser.add_argument('-c', '--cache',
+                        help='The path to a JSON file caching the attribute names of each '
+                             'XML file.')
 
     # Parse the arguments
     args = parser.parse_args()
 
     # Run the main function
-    main(args.xml_files)
-
-
+    main(args.xml_files, args.jobs, args.cache)
@@ -0,0 +1,258 @@
+"""
+Persistent index of the GUIDs, ports and datas of a tree of ICD and AV files
+
+The index is a SQLite file giving, for a GUID or a name, the files and the
+elements where it is defined:
+- HFSamplingPort and HFQueuingPort elements of the AV files, with their
+  Guid attribute
+- devices, channels, dataContainers, sublists and datas elements of the ICD
+  files, with the value of their 'GUID' configs child, see
+  xmlpipeline.element_guid
+
+Elements are located by a path of tags and names, for example
+'ICD/bus/channels[CH0]/dataContainers[VL0_0]/sublists[P0_0_0]'. An update
+only parses the new and modified files, and forgets the deleted ones.
+"""
+import argparse
+from contextlib import closing
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+
+from portscan import PORT_TAGS
+from xmlpipeline import AFDX_PORT_TYPES, Extractor, Pipeline, element_guid
+
+# Version of the index tables, an index of an other version is rebuilt
+INDEX_VERSION = 3
+
+ICD_TAGS = frozenset(["devices", "channels", "dataContainers", "sublists", "datas"])
+
+# extensions of the indexed files
+EXTENSIONS = (".xml", ".ate")
+
+SCHEMA = """
+CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime_ns INTEGER, size INTEGER,
+                    sha1 TEXT);
+CREATE TABLE entries (file_id INTEGER, kind TEXT, name TEXT, guid TEXT, path TEXT, attributes TEXT);
+CREATE INDEX entries_guid ON entries (guid);
+CREATE INDEX entries_name ON entries (name);
+CREATE INDEX entries_file ON entries (file_id);
+"""
+
+
+class IndexExtractor(Extractor):
+    """Entries of the index: dictionaries with the kind (tag), name, guid,
+    path and attributes of the indexed elements, sent when they end"""
+
+    def __init__(self, sink):
+        """
+        Args:
+            sink (callable): Called with each entry.
+        """
+        self.sink = sink
+        # (path, entry or None) of the open elements
+        self.stack = []
+
+    def begin_file(self, file_path):
+        self.stack = []
+
+    def start(self, tag, attrib):
+        tag = tag.rsplit("}", 1)[-1]
+        name = attrib.get("name", attrib.get("Name"))
+        segment = tag if name is None else f"{tag}[{name}]"
+        parent_path, parent = self.stack[-1] if self.stack else (None, None)
+        path = segment if parent_path is None else parent_path + "/" + segment
+
+        entry = None
+        guid = attrib.get("Guid", attrib.get("GUID"))
+        if tag in PORT_TAGS or tag in ICD_TAGS or guid is not None:
+            # reference lists ('//@bus/@datas.1 ...') are not key attributes
+            attributes = {k: v for k, v in attrib.items() if not v.startswith("//@")}
+            # GUID state until the end of the element, see element_guid
+            entry = {"kind": tag, "name": name, "guid": (guid, guid is not None), "path": path,
+                     "attributes": attributes}
+        elif parent is not None:
+            afdx_port = parent["kind"] == "sublists" and \
+                parent["attributes"].get("type") in AFDX_PORT_TYPES
+            parent["guid"] = element_guid(parent["guid"], tag, attrib, afdx_port)
+        self.stack.append((path, entry))
+
+    def end(self, tag):
+        _, entry = self.stack.pop()
+        if entry is not None:
+            entry["guid"] = entry["guid"][0]
+            self.sink(entry)
+
+
+def file_hash(file_path):
+    """
+    Returns:
+        str: The SHA-1 hexadecimal digest of the content of a file.
+    """
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class GUIDIndex(object):
+    """SQLite index of the GUIDs and names of ICD and AV files"""
+
+    def __init__(self, index_file):
+        """
+        Args:
+            index_file (str): The path to the SQLite file, created if needed.
+        """
+        self.conn = sqlite3.connect(index_file)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_VERSION:
+            if version:
+                logging.info(f"Rebuilding index {index_file} of version {version}")
+            self.conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS entries;" +
+                                    SCHEMA + f"PRAGMA user_version = {INDEX_VERSION};")
+
+    def close(self):
+        self.conn.close()
+
+    def is_unchanged(self, file_path, stat):
+        """
+        Check a file against the index, its content is only hashed when its
+        mtime or size changed.
+
+        Returns:
+            bool: True if the entries of the file are up to date.
+        """
+        row = self.conn.execute("SELECT id, mtime_ns, size, sha1 FROM files WHERE path = ?",
+                                (file_path,)).fetchone()
+        if row is None:
+            return False
+        file_id, mtime_ns, size, sha1 = row
+        if (mtime_ns, size) == (stat.st_mtime_ns, stat.st_size):
+            return True
+        if sha1 != file_hash(file_path):
+            return False
+        self.conn.execute("UPDATE files SET mtime_ns = ?, size = ? WHERE id = ?",
+                          (stat.st_mtime_ns, stat.st_size, file_id))
+        return True
+
+    def remove(self, file_path):
+        """Forget the entries of a file"""
+        row = self.conn.execute("SELECT id FROM files WHERE path = ?", (file_path,)).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM entries WHERE file_id = ?", row)
+            self.conn.execute("DELETE FROM files WHERE id = ?", row)
+
+    def add_file(self, file_path, stat):
+        """
+        Parse a file and replace its entries.
+
+        Raises:
+            xml.etree.ElementTree.ParseError: The file is not well-formed XML,
+                its previous entries are kept.
+        """
+        entries = []
+        Pipeline([IndexExtractor(entries.append)]).parse_file(file_path)
+        self.remove(file_path)
+        row = (file_path, stat.st_mtime_ns, stat.st_size, file_hash(file_path))
+        file_id = self.conn.execute(
+            "INSERT INTO files (path, mtime_ns, size, sha1) VALUES (?, ?, ?, ?)", row).lastrowid
+        self.conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                              [(file_id, e["kind"], e["name"], e["guid"], e["path"],
+                                json.dumps(e["attributes"])) for e in entries])
+        return len(entries)
+
+    def update(self, file_paths):
+        """
+        Index the new and modified files, and forget the indexed files which
+        no longer exist.
+
+        Args:
+            file_paths (iterable of str): The paths to the files, made absolute.
+
+        Returns:
+            int: The number of files which could not be parsed.
+        """
+        indexed = unchanged = errors = 0
+        for file_path in file_paths:
+            file_path = os.path.abspath(file_path)
+            try:
+                stat = os.stat(file_path)
+                if self.is_unchanged(file_path, stat):
+                    unchanged += 1
+                    continue
+                count = self.add_file(file_path, stat)
+            except (ET.ParseError, OSError) as e:
+                errors += 1
+                logging.error(f"Error indexing file {file_path}: {type(e).__name__}: {e}")
+                continue
+            indexed += 1
+            logging.info(f"Indexed {count} elements of {file_path}")
+            self.conn.commit()
+
+        deleted = [path for path, in self.conn.execute("SELECT path FROM files")
+                   if not os.path.exists(path)]
+        for file_path in deleted:
+            self.remove(file_path)
+        self.conn.commit()
+        logging.info(f"{unchanged} files unchanged, {indexed} indexed, {len(deleted)} deleted, "
+                     f"{errors} errors")
+        return errors
+
+    def lookup(self, guid=None, name=None):
+        """
+        Find the elements of a GUID and/or a name.
+
+        Args:
+            guid (str): The GUID of the elements.
+            name (str): The name of the elements, or a glob pattern.
+
+        Returns:
+            list of dict: The file, kind, name, guid, path and attributes of
+                each element, sorted by file and path.
+        """
+        conditions = []
+        params = []
+        if guid is not None:
+            conditions.append("entries.guid = ?")
+            params.append(guid)
+        if name is not None:
+            conditions.append("entries.name GLOB ?")
+            params.append(name)
+        query = ("SELECT files.path, kind, name, guid, entries.path, attributes FROM entries "
+                 "JOIN files ON files.id = entries.file_id")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY files.path, entries.path"
+        return [{"file": row[0], "kind": row[1], "name": row[2], "guid": row[3], "path": row[4],
+                 "attributes": json.loads(row[5])} for row in self.conn.execute(query, params)]
+
+
+if __name__ == "__main__":
+    from av2csv import get_all_files
+
+    parser = argparse.ArgumentParser(
+        description="Index the GUIDs and names of ICD and AV files, and look them up.")
+    parser.add_argument('index', help='The path to the SQLite index file.')
+    parser.add_argument('-d', '--directory', action='append', default=[],
+                        help='Update the index with the XML and ate files of this directory, '
+                             'may be repeated.')
+    parser.add_argument('-g', '--guid', help='Look up the elements of this GUID.')
+    parser.add_argument('-n', '--name', help='Look up the elements of this name, or glob pattern.')
+    parser.add_argument('files', nargs='*', help='Update the index with these files.')
+
+    args = parser.parse_args()
+
+    with closing(GUIDIndex(args.index)) as index:
+        if args.directory or args.files:
+            files = list(args.files)
+            for directory in args.directory:
+                files.extend(get_all_files(directory, EXTENSIONS))
+            index.update(files)
+        if args.guid is not None or args.name is not None:
+            for element in index.lookup(args.guid, args.name):
+                print(f"{element['file']}\t{element['path']}\t{element['kind']}\t"
+                      f"{element['guid'] or ''}\t{json.dumps(element['attributes'])}")
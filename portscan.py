@@ -0,0 +1,69 @@
+"""
+Fast scan of the HFSamplingPort and HFQueuingPort elements of XML files
+
+The file is fed by chunks to an expat parser whose target only keeps the
+attributes of the port elements: no element tree is built, so the time and
+memory of a scan depend on the number of ports rather than on the size of
+the document.
+"""
+import xml.etree.ElementTree as ET
+
+PORT_TAGS = ("HFSamplingPort", "HFQueuingPort")
+
+# size of the chunks read from the XML file
+CHUNK_SIZE = 64 * 1024
+
+
+class PortCollector(object):
+    """XMLParser target collecting the attributes of the port elements"""
+
+    def __init__(self, tags=PORT_TAGS):
+        """
+        Args:
+            tags (iterable of str): The tags of the collected elements.
+        """
+        self.tags = frozenset(tags)
+        self.ports = []
+
+    def start(self, tag, attrib):
+        if tag in self.tags:
+            self.ports.append(attrib)
+
+    def pop(self):
+        """
+        Returns:
+            list of dict: The attributes collected since the last call.
+        """
+        ports = self.ports
+        self.ports = []
+        return ports
+
+    def close(self):
+        return self.pop()
+
+
+def iter_ports(file_path, tags=PORT_TAGS, chunk_size=CHUNK_SIZE):
+    """
+    Scan an XML file for port elements.
+
+    Args:
+        file_path (str): The path to the XML file.
+        tags (iterable of str): The tags of the port elements.
+        chunk_size (int): The number of bytes parsed at once.
+
+    Returns:
+        generator: The attributes dictionary of each port, in document order.
+
+    Raises:
+        xml.etree.ElementTree.ParseError: The file is not well-formed XML.
+    """
+    collector = PortCollector(tags)
+    parser = ET.XMLParser(target=collector)
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            yield from collector.pop()
+    yield from parser.close()
@@ -0,0 +1,113 @@
+"""
+Parse many ate files in worker processes
+
+Each file is parsed in its own worker process, so a worker killed by the
+system or crashing only fails its file. Parsed ICDs are sent back to the
+calling process as snapshots, see the snapshot module.
+"""
+from collections import namedtuple
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import traceback
+
+from s.utest.pyicd import snapshot
+from s.utest.pyicd.parser import ICDParser
+
+logger = logging.getLogger("ate2009-ICD-batch")
+
+BatchResult = namedtuple("BatchResult", ["path", "icd", "error"])
+BatchResult.__doc__ = """Result of a parsed file, icd is None and error holds
+the error message if parsing failed"""
+
+
+def _limit_memory(max_memory):
+    """Limit the address space of the worker process"""
+    if max_memory:
+        import resource
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+
+
+def _parse(icd_path, parser_options):
+    """Worker function
+    Returns: (snapshot, None) or (None, error message)
+    """
+    try:
+        icd = ICDParser(icd_path, **parser_options).icd
+        return snapshot.dumps(icd), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def _run(conn, icd_path, parser_options, max_memory):
+    """Worker process, sends the result of _parse through conn"""
+    _limit_memory(max_memory)
+    conn.send(_parse(icd_path, parser_options))
+    conn.close()
+
+
+def iter_parse_files(icd_paths, jobs=None, max_memory=None, **parser_options):
+    """Parse ate files in parallel
+    Args:
+        icd_paths: list of ate files
+        jobs: maximum number of worker processes, the number of CPUs if None
+        max_memory: maximum memory in bytes of a worker process
+        parser_options: ICDParser keyword arguments
+
+    Returns: generator of BatchResult, in the order of icd_paths
+    """
+    icd_paths = list(icd_paths)
+    jobs = jobs or os.cpu_count() or 1
+    # connection -> (position in icd_paths, worker process)
+    running = {}
+    # position -> (snapshot, error) of the files done out of order
+    results = {}
+    started = done = 0
+    try:
+        while done < len(icd_paths):
+            while started < len(icd_paths) and len(running) < jobs:
+                recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+                args = (send_conn, icd_paths[started], parser_options, max_memory)
+                process = multiprocessing.Process(target=_run, args=args, daemon=True)
+                process.start()
+                # the connection only reaches end of file once the worker exits
+                send_conn.close()
+                running[recv_conn] = started, process
+                started += 1
+
+            for conn in wait(list(running)):
+                pos, process = running.pop(conn)
+                try:
+                    results[pos] = conn.recv()
+                except EOFError:
+                    # the worker died, for example killed by the system
+                    process.join()
+                    message = "Worker process exited with code {}".format(process.exitcode)
+                    results[pos] = None, message
+                conn.close()
+                process.join()
+
+            while done in results:
+                data, error = results.pop(done)
+                icd_path = icd_paths[done]
+                done += 1
+                icd = None
+                if data is not None:
+                    icd = snapshot.loads(data)
+                else:
+                    logger.error(f"Error parsing {icd_path}: {error.strip().splitlines()[-1]}")
+                yield BatchResult(icd_path, icd, error)
+    finally:
+        for conn, (_, process) in running.items():
+            process.terminate()
+            process.join()
+            conn.close()
+
+
+def parse_files(icd_paths, jobs=None, max_memory=None, **parser_options):
+    """Parse ate files in parallel, see iter_parse_files
+    Returns: list of BatchResult, in the order of icd_paths
+    """
+    return list(iter_parse_files(icd_paths, jobs, max_memory, **parser_options))
@@ -0,0 +1,194 @@
+"""
+Local disk cache of parsed ICDs
+
+A snapshot of the resolved ICD is stored for each ate file, keyed by the file
+path, size, modification time and content hash. Snapshots of an other pyICD
+schema version are discarded when read.
+"""
+import glob
+import hashlib
+import logging
+import optparse
+import os
+import tempfile
+
+from s.utest.pyicd import snapshot
+from s.utest.pyicd.pyICD import SCHEMA_VERSION
+
+logger = logging.getLogger("ate2009-ICD-cache")
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+SUFFIX = ".icd"
+
+
+def default_directory():
+    """Get the cache directory: $PYICD_CACHE_DIR or ~/.cache/pyicd"""
+    res = os.environ.get("PYICD_CACHE_DIR")
+    if not res:
+        res = os.path.join(os.path.expanduser("~"), ".cache", "pyicd")
+    return res
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Get the hash of a file content
+    Args:
+        path: file path
+        chunk_size: size of the blocks read
+    Returns: hexadecimal digest
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(chunk_size)
+    return h.hexdigest()
+
+
+class ICDCache(object):
+    """Snapshots of parsed ICDs stored in a local directory"""
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        """
+        Args:
+            directory: cache directory, see default_directory
+            max_size: maximum size in bytes of the stored snapshots, least
+                recently used snapshots are removed above this size
+        """
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+
+    @staticmethod
+    def _path_key(icd_path):
+        return hashlib.sha1(os.path.abspath(icd_path).encode("utf-8")).hexdigest()
+
+    def key(self, icd_path):
+        """Get the cache key of an ate file
+        Args:
+            icd_path: path of the ate file
+        Returns: string built from the path, size, mtime and content of the file
+        """
+        st = os.stat(icd_path)
+        content_key = "{} {} {} {}".format(st.st_size, st.st_mtime_ns,
+                                           file_digest(icd_path), SCHEMA_VERSION)
+        return "{}-{}".format(self._path_key(icd_path),
+                              hashlib.sha1(content_key.encode("utf-8")).hexdigest())
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def _entries(self, icd_path=None):
+        pattern = "*" + SUFFIX
+        if icd_path is not None:
+            pattern = self._path_key(icd_path) + "-" + pattern
+        return glob.glob(os.path.join(self.directory, pattern))
+
+    def load(self, icd_path, key=None):
+        """Get the parsed ICD of an ate file from the cache
+        Args:
+            icd_path: path of the ate file
+            key: cache key of the file if already computed
+        Returns: pyICD ICD object, None if not in cache
+        """
+        entry = self._entry(key or self.key(icd_path))
+        try:
+            with open(entry, "rb") as f:
+                data = f.read()
+        except OSError:
+            logger.debug(f"cache miss for {icd_path}")
+            return None
+        try:
+            res = snapshot.loads(data)
+        except snapshot.SnapshotError as e:
+            logger.info(f"discard snapshot of {icd_path}: {e}")
+            self._remove(entry)
+            return None
+        # mark as recently used
+        os.utime(entry)
+        logger.debug(f"cache hit for {icd_path}")
+        return res
+
+    def store(self, icd_path, icd, key=None):
+        """Store the parsed ICD of an ate file
+        Args:
+            icd_path: path of the ate file
+            icd: pyICD ICD object
+            key: cache key of the file if already computed
+        """
+        key = key or self.key(icd_path)
+        entry = self._entry(key)
+        data = snapshot.dumps(icd)
+        os.makedirs(self.directory, exist_ok=True)
+        # remove snapshots of previous versions of the file
+        for old in self._entries(icd_path):
+            if old != entry:
+                self._remove(old)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, entry)
+        except BaseException:
+            self._remove(tmp)
+            raise
+        logger.debug(f"stored {len(data)} bytes snapshot of {icd_path}")
+        self.evict()
+
+    def invalidate(self, icd_path=None):
+        """Remove snapshots from the cache
+        Args:
+            icd_path: ate file whose snapshots are removed, None to clear the
+                whole cache
+        """
+        for entry in self._entries(icd_path):
+            self._remove(entry)
+
+    def evict(self):
+        """Remove least recently used snapshots until the cache size is below
+        max_size"""
+        entries = []
+        total = 0
+        for entry in self._entries():
+            try:
+                st = os.stat(entry)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+            total += st.st_size
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            logger.debug(f"evict {entry}")
+            self._remove(entry)
+            total -= size
+
+    @staticmethod
+    def _remove(entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    opt_parser = optparse.OptionParser(usage="%prog [options] [ICD...]")
+    opt_parser.add_option('-d', '--directory',
+                          help='cache directory',
+                          dest='directory',
+                          default=None)
+    opt_parser.add_option('--clear',
+                          help='remove all snapshots',
+                          action='store_true',
+                          dest='clear',
+                          default=False)
+
+    options, args = opt_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    cache = ICDCache(options.directory)
+    if options.clear:
+        cache.invalidate()
+    # given ICDs are invalidated
+    for arg in args:
+        cache.invalidate(arg)
@@ -0,0 +1,121 @@
+"""
+External merge sort of strings
+
+Strings are sorted in memory by runs of about max_memory bytes, runs are
+spilled to temporary files and merged back. As soon as MAX_RUNS runs of the
+same level are spilled, they are merged into one run of the next level, so
+that the number of open files grows with the logarithm of the number of
+runs.
+"""
+import heapq
+import logging
+import re
+import sys
+import tempfile
+
+logger = logging.getLogger("ate2009-ICD-extsort")
+
+DEFAULT_MAX_MEMORY = 256 * 1024 * 1024
+# maximum number of runs merged at once
+MAX_RUNS = 64
+# minimum number of strings of a spilled run, a small memory budget does not
+# spill a file per string
+MIN_RUN_LENGTH = 1024
+
+_ESCAPED = re.compile(r"\\(.)")
+
+
+def _escape(line):
+    return line.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _unescape(line):
+    if "\\" not in line:
+        return line
+    return _ESCAPED.sub(lambda m: "\n" if m.group(1) == "n" else m.group(1), line)
+
+
+def unique(items):
+    """Skip consecutive duplicates of a sorted iterable"""
+    previous = None
+    first = True
+    for item in items:
+        if first or item != previous:
+            yield item
+            previous = item
+            first = False
+
+
+def _spill(items, tmp_dir):
+    """Write sorted strings into a temporary file, one escaped string per line
+    Returns: file object, positioned at its beginning
+    """
+    f = tempfile.TemporaryFile("w+", encoding="utf-8", newline="\n", dir=tmp_dir)
+    for item in items:
+        f.write(_escape(item))
+        f.write("\n")
+    f.seek(0)
+    return f
+
+
+def _read(f):
+    for line in f:
+        yield _unescape(line[:-1])
+
+
+def _merge(runs):
+    return unique(heapq.merge(*[_read(f) for f in runs]))
+
+
+def _add_run(runs, f, tmp_dir):
+    """Append a spilled run of level 0, merging the last runs while MAX_RUNS
+    of them have the same level
+    Args:
+        runs: list of (level, file object), levels in decreasing order
+        f: file object of the new run
+    """
+    runs.append((0, f))
+    while len(runs) >= MAX_RUNS and runs[-MAX_RUNS][0] == runs[-1][0]:
+        level = runs[-1][0]
+        files = [f for _, f in runs[-MAX_RUNS:]]
+        merged = _spill(_merge(files), tmp_dir)
+        for f in files:
+            f.close()
+        del runs[-MAX_RUNS:]
+        runs.append((level + 1, merged))
+
+
+def sorted_unique(items, max_memory=DEFAULT_MAX_MEMORY, tmp_dir=None):
+    """Sort strings and remove duplicates, using temporary files when the
+    strings do not fit in max_memory
+    Args:
+        items: iterable of strings
+        max_memory: approximative memory budget in bytes
+        tmp_dir: directory of the temporary files, system default if None
+
+    Returns: generator of the sorted strings, without duplicates
+    """
+    runs = []
+    run = []
+    size = 0
+    try:
+        for item in items:
+            run.append(item)
+            size += sys.getsizeof(item)
+            if size >= max_memory and len(run) >= MIN_RUN_LENGTH:
+                run.sort()
+                _add_run(runs, _spill(unique(run), tmp_dir), tmp_dir)
+                logger.debug(f"spilled run {len(runs)} of {len(run)} strings")
+                run = []
+                size = 0
+        run.sort()
+        if not runs:
+            yield from unique(run)
+            return
+        if run:
+            _add_run(runs, _spill(unique(run), tmp_dir), tmp_dir)
+        run = None
+        yield from _merge([f for _, f in runs])
+    finally:
+        for _, f in runs:
+            f.close()
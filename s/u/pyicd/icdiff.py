@@ -0,0 +1,252 @@
+"""
+Structural comparison of two ICDs
+
+Elements are compared as they are dumped by ICDDumper. A fingerprint is
+computed for every dumped subtree, and only the subtrees whose fingerprints
+differ are visited.
+
+Computing the fingerprints of an ICD visits all its elements, so the first
+comparison of an ICD costs time proportional to its size. The fingerprints
+are then kept in ICD.fingerprints, for the lifetime of the ICD object (see
+icdserver), and may be stored with its cache snapshot (see cache and
+ICDDiff.store_fingerprints). Later comparisons of the same ICDs cost time
+proportional to their differences.
+"""
+from collections import namedtuple
+import hashlib
+import logging
+import sys
+
+from s.utest.pyicd.icdump import ICDDumper, get_option_parser, configure_logging
+from s.utest.pyicd.pyICD import ICD, IndexedElement
+
+logger = logging.getLogger("ICDDiff-ICD")
+
+# Version of the dump format the fingerprints are computed from, to increase
+# when ICDDumper dumps elements differently
+DUMP_VERSION = 1
+
+ICDDifferences = namedtuple("ICDDifferences", ["added", "removed", "changed"])
+ICDDifferences.__doc__ = """Differences between two ICDs
+added: paths of the elements only in the second ICD
+removed: paths of the elements only in the first ICD
+changed: list of (path, removed lines, added lines) of the elements whose
+    attributes differ, lines being relative to the element path
+"""
+
+
+def fingerprint_key(options):
+    """Get the key of the fingerprints computed with the given dump options,
+    see ICD.fingerprints. Fingerprints of an other DUMP_VERSION are not used."""
+    return DUMP_VERSION, bool(options.ignore_empty), bool(options.ignore_type_changed)
+
+
+class ICDDiff(ICDDumper):
+    """Compare two ICDs with subtree fingerprints"""
+
+    def __init__(self, icd1, icd2, options):
+        """
+        Args:
+            icd1: path of the first ate file, or pyICD ICD object
+            icd2: path of the second ate file, or pyICD ICD object
+            options: ICDDumper options, with store_fingerprints True the
+                ICDs read from the cache are stored again with their
+                fingerprints after the comparison
+        """
+        super(ICDDiff, self).__init__(icd1, options)
+        self.ip2 = None
+        if isinstance(icd2, ICD):
+            self.icd2 = icd2
+        else:
+            self.ip2 = self.get_parser(icd2)
+            self.icd2 = self.ip2.icd
+        # (ate file, cache key at parse time) of the ICDs read from the
+        # cache, None otherwise
+        self._cached = [(icd, ip.cache_key) if ip is not None and ip.cache_key else None
+                        for icd, ip in ((icd1, self.ip1), (icd2, self.ip2))]
+        # pyICD object -> fingerprint of its dumped subtree, for each ICD
+        key = fingerprint_key(options)
+        self._fingerprints1 = self.icd.fingerprints.setdefault(key, {})
+        self._fingerprints2 = self.icd2.fingerprints.setdefault(key, {})
+        # ids of the tables where fingerprints of indexed elements were added
+        self._updated = set()
+
+    def own_lines(self, obj):
+        """Get the dumped attributes of an element, relative to its path
+        Returns: set of strings
+        """
+        return set(path for path, _ in self.iter_attributes("", obj))
+
+    def child_groups(self, obj):
+        """Get the dumped children of an element by relative path
+        Returns: dictionary relative path -> list of pyICD objects
+        """
+        res = {}
+        for sep, child in self.iter_children(obj):
+            res.setdefault(sep + "/" + child.get_name(), []).append(child)
+        return res
+
+    def fingerprint(self, obj, fingerprints):
+        """Get the fingerprint of the dumped subtree of an element
+        Args:
+            obj: pyICD object
+            fingerprints: fingerprints of the ICD of obj
+        Returns: bytes
+        """
+        res = fingerprints.get(obj)
+        if res is None:
+            h = hashlib.blake2b(digest_size=16)
+            for line in sorted(self.own_lines(obj)):
+                h.update(line.encode("utf-8"))
+                h.update(b"\0")
+            groups = self.child_groups(obj)
+            for key in sorted(groups):
+                h.update(b"\1")
+                h.update(self.group_fingerprint(groups[key], fingerprints))
+                h.update(key.encode("utf-8"))
+            res = fingerprints[obj] = h.digest()
+            if isinstance(obj, IndexedElement):
+                self._updated.add(id(fingerprints))
+        return res
+
+    def group_fingerprint(self, objs, fingerprints):
+        """Get the fingerprint of elements dumped at the same path"""
+        if len(objs) == 1:
+            return self.fingerprint(objs[0], fingerprints)
+        return b"".join(sorted(self.fingerprint(obj, fingerprints) for obj in objs))
+
+    def group_lines(self, objs):
+        """Get the dumped paths of elements dumped at the same path, relative
+        to this path"""
+        res = set()
+        for obj in objs:
+            for path, _ in self.iter_elements("", obj):
+                res.add(path[len(obj.get_name()) + 1:])
+        return res
+
+    def compare(self, path, objs1, objs2, result):
+        """Compare elements dumped at the same path
+        Args:
+            path: dump path
+            objs1: list of pyICD objects of the first ICD
+            objs2: list of pyICD objects of the second ICD
+            result: ICDDifferences to update
+        """
+        fingerprint1 = self.group_fingerprint(objs1, self._fingerprints1)
+        if fingerprint1 == self.group_fingerprint(objs2, self._fingerprints2):
+            return
+        if len(objs1) != 1 or len(objs2) != 1:
+            # several elements with the same path, compare their dumps
+            lines1 = self.group_lines(objs1)
+            lines2 = self.group_lines(objs2)
+            if lines1 != lines2:
+                result.changed.append((path, sorted(lines1 - lines2), sorted(lines2 - lines1)))
+            return
+
+        logger.debug(f"compare {path}")
+        lines1 = self.own_lines(objs1[0])
+        lines2 = self.own_lines(objs2[0])
+        if lines1 != lines2:
+            result.changed.append((path, sorted(lines1 - lines2), sorted(lines2 - lines1)))
+        self.compare_children(path, self.child_groups(objs1[0]), self.child_groups(objs2[0]),
+                              result)
+
+    @staticmethod
+    def compare_keys(groups1, groups2):
+        """Iterate the keys of two children dictionaries
+        Returns: generator of (key, in first, in second), sorted by key
+        """
+        for key in sorted(set(groups1) | set(groups2)):
+            yield key, key in groups1, key in groups2
+
+    def compare_children(self, path, groups1, groups2, result):
+        for key, in1, in2 in self.compare_keys(groups1, groups2):
+            if not in2:
+                result.removed.append(path + key)
+            elif not in1:
+                result.added.append(path + key)
+            else:
+                self.compare(path + key, groups1[key], groups2[key], result)
+
+    def diff(self):
+        """Compare the two ICDs
+        Returns: ICDDifferences
+        """
+        result = ICDDifferences([], [], [])
+        devices1 = {}
+        for device in self.icd.devices:
+            devices1.setdefault(device.get_name(), []).append(device)
+        devices2 = {}
+        for device in self.icd2.devices:
+            devices2.setdefault(device.get_name(), []).append(device)
+
+        for key, in1, in2 in self.compare_keys(devices1, devices2):
+            if not in2:
+                result.removed.append(key)
+            elif not in1:
+                result.added.append(key)
+            else:
+                self.compare(key, devices1[key], devices2[key], result)
+        if getattr(self.options, "store_fingerprints", False):
+            self.store_fingerprints()
+        return result
+
+    def store_fingerprints(self):
+        """Store the ICDs read from the cache again if fingerprints were
+        computed, so the next comparisons reuse them. A snapshot is stored
+        under the cache key of the file content it was parsed from, a file
+        modified since is not stored under its new content."""
+        for cached, icd, fingerprints in zip(self._cached, (self.icd, self.icd2),
+                                             (self._fingerprints1, self._fingerprints2)):
+            if cached is not None and id(fingerprints) in self._updated:
+                path, key = cached
+                logger.info(f"Storing the fingerprints of {path}")
+                self.cache.store(path, icd, key)
+        self._updated.clear()
+
+    def report(self, output=None):
+        """Write the differences
+        Args:
+            output: path of the output file, standard output if None
+        Returns: True if the ICDs differ
+        """
+        result = self.diff()
+        f = sys.stdout if output is None else open(output, "w", encoding="utf-8")
+        try:
+            for line in self._report_lines(result):
+                f.write(line)
+                f.write("\n")
+        finally:
+            if output is not None:
+                f.close()
+        return bool(result.added or result.removed or result.changed)
+
+    @staticmethod
+    def _report_lines(result):
+        """Report lines sorted by path"""
+        entries = [(path, "- " + path, ()) for path in result.removed]
+        entries += [(path, "+ " + path, ()) for path in result.added]
+        for path, removed, added in result.changed:
+            details = ["    - " + line for line in removed] + ["    + " + line for line in added]
+            entries.append((path, "~ " + path, details))
+        entries.sort(key=lambda entry: entry[0])
+        for _, line, details in entries:
+            yield line
+            yield from details
+
+
+if __name__ == "__main__":
+    opt_parser = get_option_parser(usage="%prog [options] ICD1 ICD2")
+    opt_parser.add_option('--store-fingerprints',
+                          help='store the fingerprints of the compared ICDs with their cache '
+                               'snapshot',
+                          action='store_true',
+                          dest='store_fingerprints',
+                          default=False)
+    options, args = opt_parser.parse_args()
+    configure_logging(options)
+
+    if len(args) != 2:
+        opt_parser.error("two ICD files are expected")
+    c = ICDDiff(args[0], args[1], options)
+    sys.exit(1 if c.report(options.output) else 0)
@@ -0,0 +1,407 @@
+"""
+Resident ICD service
+
+A server process keeps parsed ICDs in memory and answers the dump, query and
+diff requests of clients over a Unix domain socket, so repeated operations
+on the same ate files do not pay the import, parse and resolve costs again.
+An ICD is parsed again when its file changes, and the least recently used
+ICDs are evicted above a maximum number.
+
+Protocol: the client sends a JSON object on one line, {"op": ..., ...}. The
+server answers with JSON lines {"lines": [...]} holding the output lines,
+ended by {"ok": true, "differ": ...} or {"ok": false, "error": message}.
+
+The parser, diff and query modules are only imported by the server code, so
+that the client commands start quickly.
+"""
+from collections import OrderedDict
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from s.utest.pyicd.cache import default_directory
+from s.utest.pyicd.extsort import sorted_unique, DEFAULT_MAX_MEMORY
+from s.utest.pyicd.options import get_option_parser, configure_logging
+
+logger = logging.getLogger("ate2009-ICD-server")
+
+DEFAULT_MAX_ICDS = 8
+# maximum number of output lines per message
+BATCH_SIZE = 1000
+# ICDDumper options which may be given by requests
+DUMP_OPTIONS = ("ignore_order", "ignore_index", "ignore_type_changed", "ignore_empty")
+
+
+class ICDServerError(Exception):
+    """Error reported by the server"""
+
+
+def default_socket():
+    """Get the server socket path: $PYICD_SOCKET or icdserver.sock in the
+    cache directory"""
+    res = os.environ.get("PYICD_SOCKET")
+    if not res:
+        res = os.path.join(default_directory(), "icdserver.sock")
+    return res
+
+
+class LoadedICD(object):
+    """Parsed ICD of an ate file, parsed again when the file changes"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: absolute path of the ate file
+        """
+        self.path = path
+        self.icd = None
+        # (mtime, size) of the file when parsed
+        self.key = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def load(self, parser_options):
+        """Parse the file if it changed since the last call
+        Args:
+            parser_options: ICDParser keyword arguments
+        Returns: self
+        """
+        from s.utest.pyicd.parser import ICDParser
+
+        with self._lock:
+            stat = os.stat(self.path)
+            key = (stat.st_mtime_ns, stat.st_size)
+            if key != self.key:
+                logger.info(f"Parsing {self.path}")
+                self.icd = ICDParser(self.path, **parser_options).icd
+                self.key = key
+                self._index = None
+        return self
+
+    def get_index(self):
+        """Get the query.ICDIndex of the ICD, built on the first call"""
+        from s.utest.pyicd.query import ICDIndex
+
+        with self._lock:
+            if self._index is None:
+                self._index = ICDIndex(self.icd)
+            return self._index
+
+
+class ICDStore(object):
+    """Parsed ICDs by file path"""
+
+    def __init__(self, max_icds=DEFAULT_MAX_ICDS, **parser_options):
+        """
+        Args:
+            max_icds: maximum number of ICDs kept, the least recently used
+                are evicted above
+            parser_options: ICDParser keyword arguments
+        """
+        self.max_icds = max_icds
+        self.parser_options = parser_options
+        # path -> LoadedICD, least recently used first
+        self._icds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Get the parsed ICD of an ate file, parsing it if needed
+        Args:
+            path: path of the ate file
+        Returns: LoadedICD
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            loaded = self._icds.get(path)
+        if loaded is None:
+            loaded = LoadedICD(path)
+        try:
+            loaded.load(self.parser_options)
+        except Exception:
+            # a file which can not be parsed is not kept
+            with self._lock:
+                if self._icds.get(path) is loaded:
+                    del self._icds[path]
+            raise
+
+        with self._lock:
+            # kept once parsed, the first of two requests parsing it at once wins
+            loaded = self._icds.setdefault(path, loaded)
+            self._icds.move_to_end(path)
+            while len(self._icds) > self.max_icds:
+                evicted, _ = self._icds.popitem(last=False)
+                logger.info(f"Evicting {evicted}")
+        return loaded
+
+    def paths(self):
+        """Get the paths of the kept ICDs, least recently used first"""
+        with self._lock:
+            return list(self._icds)
+
+
+class ICDRequestHandler(socketserver.StreamRequestHandler):
+    """Answer the requests of a client connection, one per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            request = None
+            try:
+                request = json.loads(line)
+                differ = self.server.execute(request, self.send_lines)
+                status = {"ok": True, "differ": differ}
+            except Exception as e:
+                logger.exception(f"Error executing {line.strip()}")
+                status = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+            self.send(status)
+            if status["ok"] and request["op"] == "shutdown":
+                # once answered, serve_forever runs in an other thread
+                self.server.shutdown()
+                return
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+
+    def send_lines(self, lines):
+        """Send output lines by batches"""
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= BATCH_SIZE:
+                self.send({"lines": batch})
+                batch = []
+        if batch:
+            self.send({"lines": batch})
+
+
+class ICDServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Server answering each client connection in a thread"""
+    daemon_threads = True
+
+    def __init__(self, socket_path, store):
+        """
+        Args:
+            socket_path: path of the Unix domain socket
+            store: ICDStore
+        """
+        if os.path.exists(socket_path):
+            # left by a server which did not stop cleanly
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.remove(socket_path)
+            else:
+                raise ICDServerError(f"A server is already listening on {socket_path}")
+            finally:
+                probe.close()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+        self.store = store
+        super(ICDServer, self).__init__(socket_path, ICDRequestHandler)
+
+    def server_close(self):
+        super(ICDServer, self).server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+    @staticmethod
+    def dump_options(request):
+        """Get the ICDDumper options of a request, defaults of the command
+        line otherwise"""
+        options = get_option_parser().get_default_values()
+        for name, value in request.get("options", {}).items():
+            if name in DUMP_OPTIONS:
+                setattr(options, name, value)
+        return options
+
+    def execute(self, request, send_lines):
+        """Execute a request
+        Args:
+            request: dictionary, see the ICDClient methods
+            send_lines: function called with the iterable of output lines
+        Returns: True if the ICDs differ for a diff request, None otherwise
+        """
+        from s.utest.pyicd.icdiff import ICDDiff
+        from s.utest.pyicd.icdump import ICDDumper
+
+        op = request["op"]
+        if op == "dump":
+            icd = self.store.get(request["path"]).icd
+            dumper = ICDDumper(icd, self.dump_options(request))
+            max_memory = request.get("max_memory", DEFAULT_MAX_MEMORY)
+            send_lines(sorted_unique(dumper.iter_paths(), max_memory))
+        elif op == "query":
+            index = self.store.get(request["path"]).get_index()
+            criteria = dict(request.get("criteria", {}))
+            if isinstance(criteria.get("config"), list):
+                criteria["config"] = tuple(criteria["config"])
+            send_lines(f"{index.get_path(element)} ({type(element).__name__} {element.get_index()})"
+                       for element in index.select(**criteria))
+        elif op == "diff":
+            c = ICDDiff(self.store.get(request["path1"]).icd, self.store.get(request["path2"]).icd,
+                        self.dump_options(request))
+            result = c.diff()
+            send_lines(c._report_lines(result))
+            return bool(result.added or result.removed or result.changed)
+        elif op == "stats":
+            send_lines(self.store.paths())
+        elif op == "shutdown":
+            # done by the request handler once the request is answered
+            pass
+        else:
+            raise ValueError(f"Unknown operation '{op}'")
+        return None
+
+
+class ICDClient(object):
+    """Client of an ICDServer"""
+
+    def __init__(self, socket_path=None):
+        """
+        Args:
+            socket_path: path of the server socket, see default_socket
+        """
+        self.socket_path = socket_path or default_socket()
+        # status of the last request
+        self.status = None
+
+    def request(self, request):
+        """Send a request
+        Args:
+            request: dictionary, see ICDServer.execute
+        Returns: generator of the output lines
+        Raises: ICDServerError if the request failed or no server is listening
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(self.socket_path)
+            except OSError:
+                raise ICDServerError(f"no ICD server listening on {self.socket_path}") from None
+            try:
+                with s.makefile("rwb") as f:
+                    f.write(json.dumps(request).encode("utf-8") + b"\n")
+                    f.flush()
+                    for line in f:
+                        message = json.loads(line)
+                        if "lines" in message:
+                            yield from message["lines"]
+                            continue
+                        self.status = message
+                        if not message["ok"]:
+                            raise ICDServerError(message["error"])
+                        return
+            except OSError as e:
+                raise ICDServerError(
+                    f"connection to the ICD server on {self.socket_path} lost: {e}") from None
+        raise ICDServerError("Connection closed by the server")
+
+    def dump(self, path, options=None, max_memory=DEFAULT_MAX_MEMORY):
+        """Dump an ICD, see ICDDumper.dump
+        Args:
+            path: path of the ate file
+            options: dictionary of ICDDumper options, see DUMP_OPTIONS
+            max_memory: approximative memory budget in bytes of the sort
+        Returns: generator of the sorted paths
+        """
+        return self.request({"op": "dump", "path": os.path.abspath(path), "options": options or {},
+                             "max_memory": max_memory})
+
+    def query(self, icd_path, **criteria):
+        """Select elements of an ICD, see ICDIndex.select, where excepted
+        Args:
+            icd_path: path of the ate file
+            criteria: ICDIndex.select keyword arguments
+        Returns: generator of "path (type index)" lines
+        """
+        return self.request({"op": "query", "path": os.path.abspath(icd_path),
+                             "criteria": criteria})
+
+    def diff(self, path1, path2, options=None):
+        """Compare two ICDs, see ICDDiff.report, self.status["differ"] tells
+        whether they differ once the lines are read
+        Returns: generator of the report lines
+        """
+        return self.request({"op": "diff", "path1": os.path.abspath(path1),
+                             "path2": os.path.abspath(path2), "options": options or {}})
+
+    def stats(self):
+        """Get the paths of the ICDs kept by the server"""
+        return self.request({"op": "stats"})
+
+    def shutdown(self):
+        """Stop the server"""
+        return list(self.request({"op": "shutdown"}))
+
+
+if __name__ == "__main__":
+    opt_parser = get_option_parser(usage="%prog [options] serve | dump ICD | query ICD | "
+                                         "diff ICD1 ICD2 | stats | shutdown")
+    opt_parser.add_option('-S', '--socket',
+                          help='path of the server socket, $PYICD_SOCKET or icdserver.sock in '
+                               'the cache directory by default',
+                          dest='socket',
+                          default=None)
+    opt_parser.add_option('--max-icds',
+                          help='serve: maximum number of ICDs kept in memory',
+                          type='int',
+                          dest='max_icds',
+                          default=DEFAULT_MAX_ICDS)
+    for criterion in ("path", "name", "type", "config", "metadata"):
+        opt_parser.add_option('--' + criterion,
+                              help='query: {} criterion, see query.py'.format(criterion),
+                              dest=criterion,
+                              default=None)
+    options, args = opt_parser.parse_args()
+    configure_logging(options)
+    if not args:
+        opt_parser.error("a command is expected")
+    command, args = args[0], args[1:]
+
+    if command == "serve":
+        from s.utest.pyicd.cache import ICDCache
+
+        cache = ICDCache(options.cache_dir) if options.cache_dir else None
+        store = ICDStore(options.max_icds, streaming=options.streaming, cache=cache)
+        server = ICDServer(options.socket or default_socket(), store)
+        logger.info(f"Listening on {server.server_address}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        sys.exit(0)
+
+    client = ICDClient(options.socket)
+    dump_options = {name: getattr(options, name) for name in DUMP_OPTIONS}
+    if command == "dump" and len(args) == 1:
+        lines = client.dump(args[0], dump_options, options.max_memory * 1024 * 1024)
+    elif command == "query" and len(args) == 1:
+        config = options.config
+        if config is not None and "=" in config:
+            config = config.split("=", 1)
+        lines = client.query(args[0], path=options.path, name=options.name, type=options.type,
+                             config=config, metadata=options.metadata)
+    elif command == "diff" and len(args) == 2:
+        lines = client.diff(args[0], args[1], dump_options)
+    elif command == "stats" and not args:
+        lines = client.stats()
+    elif command == "shutdown" and not args:
+        # read in the try block below, like the other requests
+        lines = client.request({"op": "shutdown"})
+    else:
+        opt_parser.error("unexpected command or arguments")
+
+    f = sys.stdout if options.output is None else open(options.output, "w", encoding="utf-8")
+    try:
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+    except ICDServerError as e:
+        sys.exit("Error: {}".format(e))
+    finally:
+        if options.output is not None:
+            f.close()
+    sys.exit(1 if client.status.get("differ") else 0)
@@ -1,6 +1,8 @@
-from s.utest.pyicd.parser import ICDParser
-from s.utest.pyicd.pyICD import Data, DataContainer, Channel, DataContainerAttribute, DataFilter
-import optparse
+from s.utest.pyicd.parser import ICDParser, Selection
+from s.utest.pyicd.cache import ICDCache
+from s.utest.pyicd.pyICD import Data, DataContainer, Channel, Device, ICD
+from s.utest.pyicd.extsort import sorted_unique, DEFAULT_MAX_MEMORY
+from s.utest.pyicd.options import get_option_parser, configure_logging
 import logging
 
 logger = logging.getLogger("ICDDump-ICD")
@@ -15,7 +17,29 @@ class ICDDumper(object):
         if not options.ignore_index:
             raise ValueError("Preserving order not implemented, keep ignore_order option")
 
-        self.ip1 = ICDParser(icd1)
+        self.ip1 = None
+        # cache.ICDCache of the parsed files, see get_parser
+        self.cache = None
+        if isinstance(icd1, ICD):
+            self.icd = icd1
+        else:
+            self.ip1 = self.get_parser(icd1)
+            self.icd = self.ip1.icd
+
+    def get_parser(self, icd_path):
+        """Parse an ate file according to the options
+        Args:
+            icd_path: path of the ate file
+        Returns: ICDParser object
+        """
+        selection = get_selection(self.options)
+        if getattr(self.options, "cache_dir", None) and self.cache is None:
+            if selection is None:
+                self.cache = ICDCache(self.options.cache_dir)
+            else:
+                logger.warning("The cache is not used with a selection of devices or channels")
+        return ICDParser(icd_path, streaming=getattr(self.options, "streaming", False),
+                         cache=self.cache, selection=selection)
 
     def ignore(self, attr, o=None):
         """Comparison condition
@@ -47,9 +71,15 @@ class ICDDumper(object):
                 res = res or (v == '')                        
         return res
 
-    def iterate_attributes(self, parent_path, o1, result):
-        keys = o1.__dict__.keys()
-        keys = list(o1.__dict__.keys())
+    def iter_attributes(self, parent_path, o1):
+        """Iterate attributes, configs and enum elements of a pyICD object
+        Args:
+            parent_path: path of 'o1'
+            o1: pyICD object
+
+        Returns: generator of (path, value)
+        """
+        keys = list(o1.get_fields())
         keys.sort()
 
         for attr in keys:
@@ -62,141 +92,149 @@ class ICDDumper(object):
                 a=''.join(attr.split('_', 1))
                 current_path = parent_path + "/" + a + ":{}".format(v)
                 logger.debug(f'iterate_attributes {current_path}')
-                result[current_path] = getattr(o1, attr)
+                yield current_path, getattr(o1, attr)
 
         if hasattr(o1, "configs"):
             dict1= {}
             for p in o1.configs:
                 dict1[getattr(p, "_property")] = p
             for k in dict1:
-                result = self.iterate_attributes(parent_path + "/Config/" + k, dict1[k], result)
+                yield from self.iter_attributes(parent_path + "/Config/" + k, dict1[k])
         
         if hasattr(o1, "enum_elements"):
             dict1= {}
             for p in o1.enum_elements:
                 dict1[getattr(p, "_property")] = p
             for k in dict1:
-                result = self.iterate_attributes(parent_path + "/Enum/" + k, dict1[k], result)
+                yield from self.iter_attributes(parent_path + "/Enum/" + k, dict1[k])
 
+    def iterate_attributes(self, parent_path, o1, result):
+        """Add attributes of a pyICD object to a dictionary, see iter_attributes
+        Returns: updated dictionary
+        """
+        result.update(self.iter_attributes(parent_path, o1))
         return result
-           
-    def iterate_elements(self, parent_path, obj, result):
-        """Recursively iterate elements to a dictionary
+
+    @staticmethod
+    def iter_children(obj):
+        """Iterate the dumped children of a pyICD element
         Args:
-            parent_path: parent of 'obj' path
-            obj: used pyICD object
-            result: dictionary to update
+            obj: pyICD object
 
-        Returns:
+        Returns: generator of (separator, child), child path being the path of
+            'obj' + separator + "/" + child name
         """
-        current_path = parent_path + "/" + obj.get_name()
-        result[current_path] = obj
-        logger.debug(f"iterate_elements {current_path} ({type(obj)})")
-
-        result = self.iterate_attributes(current_path, obj, result)
+        if type(obj) == Device:
+            for ch in obj.channels:
+                yield "", ch
 
         if type(obj) == Channel:
             # Do not iterate datas referenced in the Channel
             #for data in obj.datas:
-            #    result = self.iterate_elements(current_path, data, result)
+            #    yield "", data
 
             for container in obj.data_containers:
-                result = self.iterate_elements(current_path, container, result)
+                yield "", container
 
         if type(obj) in [Data, DataContainer]:
             for data in obj.datas:
-                result = self.iterate_elements(current_path, data, result)
+                yield "", data
 
         if type(obj) == Data:
             if hasattr(obj, "filters"):
                 for dfilter in obj.filters:
-                    result = self.iterate_elements(current_path, dfilter, result)      
+                    yield "", dfilter
 
         elif type(obj) == DataContainer:
             for container_attr in obj.attributes:
-                result = self.iterate_elements(current_path+"/", container_attr, result)
+                yield "/", container_attr
 
             for container in obj.data_containers:
-                result = self.iterate_elements(current_path, container, result)
+                yield "", container
 
-        return result
+    def iter_elements(self, parent_path, obj):
+        """Recursively iterate elements
+        Args:
+            parent_path: parent of 'obj' path
+            obj: used pyICD object
+
+        Returns: generator of (path, pyICD object or attribute value)
+        """
+        current_path = parent_path + "/" + obj.get_name()
+        yield current_path, obj
+        logger.debug(f"iterate_elements {current_path} ({type(obj)})")
 
-    def dump(self):
-        """Dump the whole ICD
+        yield from self.iter_attributes(current_path, obj)
+
+        for sep, child in self.iter_children(obj):
+            yield from self.iter_elements(current_path + sep, child)
+
+    def iterate_elements(self, parent_path, obj, result):
+        """Recursively iterate elements to a dictionary
         Args:
-        Returns: dict1 parsed icds as paths dictionaries
+            parent_path: parent of 'obj' path
+            obj: used pyICD object
+            result: dictionary to update
+
+        Returns: updated dictionary
         """
-        logger.info(f'Dumping {self._icd}')
+        result.update(self.iter_elements(parent_path, obj))
+        return result
 
-        # convert pyICD to dictionaries to avoid false diffs from xml nodes order differences
-        result = {}
-        for device in self.ip1.icd.devices:
+    def iter_paths(self):
+        """Iterate the paths of the whole ICD, unsorted and possibly repeated
+        Returns: generator of path strings
+        """
+        for device in self.icd.devices:
             device_path = device.get_name()
-            result[device_path] = device
+            yield device_path
             logger.info(f'Dump {device_path} ({type(device)})')
-            result = self.iterate_attributes(device_path, device, result)
+            for path, _ in self.iter_attributes(device_path, device):
+                yield path
 
-            for ch in device.channels:
-                result = self.iterate_elements(device_path, ch, result)
-        
-        sorted_r = list(result.keys())
-        sorted_r.sort()
-        for key in sorted_r:
-            print(key)
+            for _, ch in self.iter_children(device):
+                for path, _ in self.iter_elements(device_path, ch):
+                    yield path
+
+    def dump(self, output=None, max_memory=DEFAULT_MAX_MEMORY):
+        """Dump the whole ICD, one sorted path per line
+        Paths are sorted with an external merge sort, using temporary files
+        when they do not fit in max_memory.
+        Args:
+            output: path of the output file, standard output if None
+            max_memory: approximative memory budget in bytes of the sort
+        """
+        logger.info(f'Dumping {self._icd}')
+
+        # sort paths to avoid false diffs from xml nodes order differences
+        lines = sorted_unique(self.iter_paths(), max_memory)
+        if output is None:
+            for key in lines:
+                print(key)
+        else:
+            with open(output, "w", encoding="utf-8") as f:
+                for key in lines:
+                    f.write(key)
+                    f.write("\n")
+
+
+def get_selection(options):
+    """Get the parser.Selection of the command line options
+    Returns: Selection, None if no device or channel is selected
+    """
+    devices = getattr(options, "devices", None)
+    channels = getattr(options, "channels", None)
+    channel_types = getattr(options, "channel_types", None)
+    if not (devices or channels or channel_types):
+        return None
+    return Selection(devices, channels, channel_types)
 
 
 if __name__ == "__main__":
     # Options management
-    opt_parser = optparse.OptionParser()
-    opt_parser.add_option('-o', '--ignore-order',
-                          help='ignore orders of elements, except Filter',
-                          action='store_false',
-                          dest='ignore_order',
-                          default=True)
-    opt_parser.add_option('-i', '--ignore-index',
-                          help='ignore index value',
-                          action='store_false',
-                          dest='ignore_index',
-                          default=True)
-    opt_parser.add_option('-t', '--ignore-type',
-                          help='ignore type changed',
-                          action='store_false',
-                          dest='ignore_type_changed',
-                          default=True)                          
-    opt_parser.add_option('-e', '--ignore-empty',
-                          help='ignore empty attributes in dump',
-                          action='store_true',
-                          dest='ignore_empty',
-                          default=False)                          
-    opt_parser.add_option('-l', '--log-level',
-                          dest="loglevel",
-                          default="WARNING")
-    opt_parser.add_option('--log-file',
-                          dest="logfile",
-                          default=None)
-
+    opt_parser = get_option_parser()
     options, args = opt_parser.parse_args()
-
-    # assuming loglevel is bound to the string value obtained from the
-    # command line argument. Convert to upper case to allow the user to
-    # specify --log=DEBUG or --log=debug
-    loglevel = options.loglevel.upper().strip()
-
-    numeric_level = getattr(logging, loglevel, None)
-    if not isinstance(numeric_level, int):
-        raise ValueError('Invalid log level: %s' % options.loglevel)
-
-    # log in a file
-    logging.basicConfig(level=numeric_level)
-
-    if options.logfile is not None:
-        handler = logging.FileHandler(options.logfile)
-        handler.setLevel(numeric_level)
-        logger.addHandler(handler)
+    configure_logging(options)
 
     c = ICDDumper(args[0], options)
-    c.dump()            
-            
-        
-
-
+    c.dump(options.output, options.max_memory * 1024 * 1024)
\ No newline at end of file
@@ -0,0 +1,317 @@
+"""
+Random access to the top-level elements of an ate file
+
+A pre-scan of the memory-mapped file records the byte range of each devices
+element and of each channels, datas and filters element of the bus, with
+its ATE path, name and type. This offset index is saved in a sidecar file next to
+the ate file, '<ate file>.offsets', and built again when the ate file
+changes.
+
+OffsetICDParser then parses only the requested elements, by wrapping their
+bytes in the root element of the file, and the elements they reference,
+recursively. The resulting ICD holds this closure only. ICDParser, given a
+parser.Selection, parses the elements found by OffsetIndex.select the same
+way.
+"""
+from collections import namedtuple
+import json
+import logging
+import mmap
+import os
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+from s.utest.pyicd.parser import ICDParser, ReferenceResolver
+from s.utest.pyicd.pyICD import ICD, Bus
+
+logger = logging.getLogger("ate2009-ICD-offsets")
+
+# Version of the sidecar file format, other versions are built again
+OFFSETS_VERSION = 2
+SUFFIX = ".offsets"
+# bus children with an ATE path, see ICDParser.parse_bus_child
+BUS_TAGS = ("channels", "datas", "filters")
+CHUNK_SIZE = 1024 * 1024
+
+OffsetEntry = namedtuple("OffsetEntry", ["path", "tag", "name", "type", "start", "end"])
+OffsetEntry.__doc__ = """Top-level element of an ate file
+path: ATE path, for example ('devices.0',) or ('bus', 'channels.3')
+name, type: name and type attributes, None if missing
+start, end: byte range of the element, possibly followed by blanks
+"""
+
+
+def top_level_path(path):
+    """Get the ATE path of the top-level element containing an element
+    Args:
+        path: ATE path, as returned by parser.split_paths
+    Returns: ATE path of a devices element or a bus child
+    """
+    return path[:2] if path[0] == "bus" else path[:1]
+
+
+class OffsetIndex(object):
+    """Byte ranges of the top-level elements of an ate file"""
+
+    def __init__(self, icd_path, root_name, header_end, entries, key):
+        """
+        Args:
+            icd_path: path of the ate file
+            root_name: qualified name of the root element
+            header_end: offset of the first child of the root element
+            entries: list of OffsetEntry, in file order
+            key: (size, mtime) of the scanned file
+        """
+        self.icd_path = icd_path
+        self.root_name = root_name
+        self.header_end = header_end
+        self.entries = entries
+        self.key = key
+        self.by_path = {entry.path: entry for entry in entries}
+
+    @staticmethod
+    def file_key(icd_path):
+        stat = os.stat(icd_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @classmethod
+    def build(cls, icd_path):
+        """Scan an ate file
+        Returns: OffsetIndex
+        """
+        key = cls.file_key(icd_path)
+        parser = expat.ParserCreate()
+        entries = []
+        # state of the scan, the pending entry ends where the next
+        # top-level element or the parent end tag starts
+        state = {"depth": 0, "in_bus": False, "pending": None, "root": None, "header_end": None}
+        root_counters = {}
+        bus_counters = {}
+
+        def close_pending(offset):
+            if state["pending"] is not None:
+                entries.append(state["pending"]._replace(end=offset))
+                state["pending"] = None
+
+        def start(name, attrs):
+            depth = state["depth"]
+            state["depth"] = depth + 1
+            if depth == 0:
+                state["root"] = name
+                return
+            offset = parser.CurrentByteIndex
+            if depth == 1:
+                close_pending(offset)
+                if state["header_end"] is None:
+                    state["header_end"] = offset
+                if name == "bus":
+                    state["in_bus"] = True
+                elif name == "devices":
+                    path = ICDParser.child_path((), name, root_counters)
+                    state["pending"] = OffsetEntry(path, name, attrs.get("name"), attrs.get("type"),
+                                                   offset, None)
+            elif depth == 2 and state["in_bus"]:
+                close_pending(offset)
+                if name in BUS_TAGS:
+                    path = ICDParser.child_path(("bus",), name, bus_counters)
+                    state["pending"] = OffsetEntry(path, name, attrs.get("name"), attrs.get("type"),
+                                                   offset, None)
+
+        def end(name):
+            depth = state["depth"] = state["depth"] - 1
+            if depth <= 1 and (depth == 0 or state["in_bus"]):
+                close_pending(parser.CurrentByteIndex)
+                state["in_bus"] = False
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        with open(icd_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(0, len(mm), CHUNK_SIZE):
+                parser.Parse(mm[pos:pos + CHUNK_SIZE], False)
+            parser.Parse(b"", True)
+        header_end = state["header_end"]
+        if header_end is None:
+            header_end = key[0]
+        logger.debug(f"Scanned {len(entries)} elements of {icd_path}")
+        return cls(icd_path, state["root"], header_end, entries, key)
+
+    @classmethod
+    def load(cls, icd_path, save=True):
+        """Get the offset index of an ate file from its sidecar file, scan
+        the ate file if the sidecar file is missing or out of date
+        Args:
+            icd_path: path of the ate file
+            save: write the sidecar file after a scan
+        Returns: OffsetIndex
+        """
+        sidecar = icd_path + SUFFIX
+        key = cls.file_key(icd_path)
+        try:
+            with open(sidecar, encoding="utf-8") as f:
+                data = json.load(f)
+            if data["version"] == OFFSETS_VERSION and data["key"] == key:
+                entries = [OffsetEntry(tuple(path.split("/")), tag, name, type_, start, end)
+                           for path, tag, name, type_, start, end in data["entries"]]
+                return cls(icd_path, data["root"], data["header_end"], entries, key)
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug(f"Cannot read {sidecar}: {e}")
+
+        res = cls.build(icd_path)
+        if save:
+            try:
+                res.save(sidecar)
+            except OSError as e:
+                logger.warning(f"Cannot write {sidecar}: {e}")
+        return res
+
+    def save(self, sidecar):
+        """Write the sidecar file"""
+        data = {"version": OFFSETS_VERSION, "key": self.key, "root": self.root_name,
+                "header_end": self.header_end,
+                "entries": [["/".join(e.path), e.tag, e.name, e.type, e.start, e.end]
+                            for e in self.entries]}
+        tmp = sidecar + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, sidecar)
+
+    def select(self, selection):
+        """Find the elements a selection starts from: the selected devices,
+        and the selected bus channels if the selection names channels or
+        channel types, see parser.Selection
+        Args:
+            selection: parser.Selection
+        Returns: list of ATE paths, in file order
+        """
+        tags = ("devices", "channels") if selection.selects_channels() else ("devices",)
+        return [entry.path for entry in self.entries
+                if entry.tag in tags and selection.match(entry.tag, entry.name, entry.type)]
+
+    def parse_closure(self, parser, paths, selection=None):
+        """Parse top-level elements and the top-level elements holding the
+        elements they reference, recursively. The objects are added to the
+        ICD of the parser in file order, their references are listed in
+        parser.to_update and resolved by the caller.
+        Args:
+            parser: ICDParser of the file
+            paths: ATE paths of the top-level elements
+            selection: parser.Selection, referenced elements which are not
+                selected are not parsed
+        Returns: number of parsed elements
+        """
+        icd = parser._icd
+        # path -> (OffsetEntry, pyICD object)
+        parsed = {}
+        with open(self.icd_path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header = mm[:self.header_end]
+            footer = "</{}>".format(self.root_name).encode("utf-8")
+            pending = list(paths)
+            followed = len(parser.to_update)
+            while pending:
+                path = pending.pop()
+                if path in parsed:
+                    continue
+                entry = self.by_path.get(path)
+                if entry is None:
+                    logger.warning(f"No element at {'/'.join(path)} in {self.icd_path}")
+                    continue
+                if selection is not None and not selection.match(entry.tag, entry.name, entry.type):
+                    parsed[path] = entry, None
+                    continue
+                elem = ET.fromstring(header + mm[entry.start:entry.end] + footer)[0]
+                parsed[path] = entry, self.parse_entry(parser, entry, elem)
+                # follow the references of the new objects
+                for update in parser.to_update[followed:]:
+                    for ref in getattr(update["obj"], update["attr"]):
+                        if ref:
+                            pending.append(top_level_path(ref))
+                followed = len(parser.to_update)
+        parsed = sorted((item for item in parsed.values() if item[1] is not None),
+                        key=lambda item: item[0].start)
+        for entry, obj in parsed:
+            if entry.tag == "devices":
+                icd.devices.append(obj)
+            else:
+                if icd.bus is None:
+                    icd.bus = Bus()
+                getattr(icd.bus, entry.tag).append(obj)
+        logger.info(f"Parsed {len(parsed)} of {len(self.entries)} elements of {self.icd_path}")
+        return len(parsed)
+
+    @staticmethod
+    def parse_entry(parser, entry, elem):
+        """Parse a top-level element with its known ATE path
+        Returns: pyICD object
+        """
+        if entry.tag == "devices":
+            return parser.parse_device(elem, entry.path)
+        if entry.tag == "channels":
+            return parser.parse_channel(elem, entry.path)
+        if entry.tag == "datas":
+            return parser.parse_data(elem, entry.path)
+        return parser.parse_filter(elem, entry.path)
+
+
+class IndexedReferenceResolver(ReferenceResolver):
+    """Resolve references through the path index only: the lists of a
+    partial ICD do not hold the elements at their ATE position"""
+
+    def resolve_ref(self, path):
+        if path:
+            return self._icd.path_index.get(path)
+        return None
+
+
+class OffsetICDParser(ICDParser):
+    """Parse some top-level elements of an ate file and the elements they
+    reference, see OffsetIndex.parse_closure"""
+
+    def __init__(self, icd_path, paths, index=None, selection=None, lazy=False, indexed=False,
+                 reverse_refs=False):
+        """
+        Args:
+            icd_path: path of the ate file
+            paths: ATE paths of the top-level elements to parse, see
+                OffsetIndex.select
+            index: OffsetIndex of the file, loaded if None
+            selection: parser.Selection, referenced bus channels which are
+                not selected are not parsed
+            lazy, indexed, reverse_refs: see ICDParser
+        """
+        self.offsets = index or OffsetIndex.load(icd_path)
+        self.paths = list(paths)
+        super(OffsetICDParser, self).__init__(icd_path, lazy=lazy, indexed=indexed,
+                                              reverse_refs=reverse_refs, selection=selection)
+
+    def eval(self):
+        """Parse the requested elements and their references
+        Returns: ICD python object
+        """
+        self._icd = ICD()
+        self._resolver = IndexedReferenceResolver(self._icd)
+        self.offsets.parse_closure(self, self.paths, self._selection)
+        self.resolve_updates()
+        return self._icd
+
+
+if __name__ == "__main__":
+    from s.utest.pyicd.icdump import ICDDumper, get_option_parser, get_selection, configure_logging
+
+    opt_parser = get_option_parser(usage="%prog [options] ICD [ICD...]\n"
+                                         "Build the offset indexes, or dump the selected "
+                                         "elements of an ICD")
+    options, args = opt_parser.parse_args()
+    configure_logging(options)
+
+    selection = get_selection(options)
+    if selection is None:
+        for arg in args:
+            offsets = OffsetIndex.load(arg)
+            print(f"{len(offsets.entries)} elements indexed in {arg + SUFFIX}")
+    elif len(args) != 1:
+        opt_parser.error("one ICD file is expected with a selection")
+    else:
+        offsets = OffsetIndex.load(args[0])
+        ip = OffsetICDParser(args[0], offsets.select(selection), offsets, selection)
+        ICDDumper(ip.icd, options).dump(options.output, options.max_memory * 1024 * 1024)
@@ -0,0 +1,100 @@
+"""
+Command line options shared by the ICD tools
+
+This module only depends on the standard library and extsort, so that the
+clients of icdserver start without importing the parser.
+"""
+import logging
+import optparse
+
+from s.utest.pyicd.extsort import DEFAULT_MAX_MEMORY
+
+logger = logging.getLogger("ICDDump-ICD")
+
+
+def get_option_parser(usage=None):
+    """Get the command line options parser, shared with the other ICD tools"""
+    opt_parser = optparse.OptionParser(usage=usage)
+    opt_parser.add_option('-o', '--ignore-order',
+                          help='ignore orders of elements, except Filter',
+                          action='store_false',
+                          dest='ignore_order',
+                          default=True)
+    opt_parser.add_option('-i', '--ignore-index',
+                          help='ignore index value',
+                          action='store_false',
+                          dest='ignore_index',
+                          default=True)
+    opt_parser.add_option('-t', '--ignore-type',
+                          help='ignore type changed',
+                          action='store_false',
+                          dest='ignore_type_changed',
+                          default=True)                          
+    opt_parser.add_option('-e', '--ignore-empty',
+                          help='ignore empty attributes in dump',
+                          action='store_true',
+                          dest='ignore_empty',
+                          default=False)                          
+    opt_parser.add_option('-s', '--streaming',
+                          help='parse the ICD with iterparse, without keeping the xml tree '
+                               'in memory',
+                          action='store_true',
+                          dest='streaming',
+                          default=False)
+    opt_parser.add_option('-c', '--cache-dir',
+                          help='look up and store the parsed ICD in this cache directory',
+                          dest='cache_dir',
+                          default=None)
+    opt_parser.add_option('-d', '--device',
+                          help='only parse the devices matching this glob pattern, may be repeated',
+                          action='append',
+                          dest='devices',
+                          default=[])
+    opt_parser.add_option('--channel',
+                          help='only parse the bus channels matching this glob pattern, '
+                               'may be repeated',
+                          action='append',
+                          dest='channels',
+                          default=[])
+    opt_parser.add_option('--channel-type',
+                          help='only parse the bus channels of this type, may be repeated',
+                          action='append',
+                          dest='channel_types',
+                          default=[])
+    opt_parser.add_option('--output',
+                          help='write the result in this file instead of the standard output',
+                          dest='output',
+                          default=None)
+    opt_parser.add_option('--max-memory',
+                          help='memory used to sort the dump, in MB, temporary files are '
+                               'used above',
+                          type='int',
+                          dest='max_memory',
+                          default=DEFAULT_MAX_MEMORY // (1024 * 1024))
+    opt_parser.add_option('-l', '--log-level',
+                          dest="loglevel",
+                          default="WARNING")
+    opt_parser.add_option('--log-file',
+                          dest="logfile",
+                          default=None)
+    return opt_parser
+
+
+def configure_logging(options):
+    """Configure logging from the command line options"""
+    # assuming loglevel is bound to the string value obtained from the
+    # command line argument. Convert to upper case to allow the user to
+    # specify --log=DEBUG or --log=debug
+    loglevel = options.loglevel.upper().strip()
+
+    numeric_level = getattr(logging, loglevel, None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % options.loglevel)
+
+    # log in a file
+    logging.basicConfig(level=numeric_level)
+
+    if options.logfile is not None:
+        handler = logging.FileHandler(options.logfile)
+        handler.setLevel(numeric_level)
+        logger.addHandler(handler)
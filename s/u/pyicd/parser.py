@@ -1,40 +1,49 @@
 from distutils.debug import DEBUG
+from fnmatch import fnmatchcase
 import logging
+import optparse
 import xml.etree.ElementTree as ET
-import sys
 
 from attr import has
 from s.utest.pyicd.pyICD import ICD, Bus, Device, Channel,\
     Data, DataContainer, DataContainerAttribute,\
-    DataFilter, Config, Metadata, EnumElement
+    DataFilter, Config, Metadata, EnumElement, LazyRefs
+from s.utest.pyicd.query import ICDIndex
 
 logger = logging.getLogger("ate2009-ICD-parser")
 
-def split_paths(value):
-    """Convert a string from ATE into a list of list of strings
+def split_paths(value, cache=None):
+    """Convert a string from ATE into a list of tuples of strings
     Args:
         value: string representing a list of ICD path, for example:
                 '//@bus/@filters.0 //@bus/@filters.1'
+        cache: optional dictionary of already split paths, so that identical
+                path strings share the same tuple
 
-    Returns: list of list of strings
+    Returns: list of tuples of strings
     """
     path_list = value.split(" ")
     res = []
     for path in path_list:
-        v = path.replace("@", "")[1:].split("/")
-        res.append(v[1:])
+        v = None
+        if cache is not None:
+            v = cache.get(path)
+        if v is None:
+            v = tuple(path.replace("@", "")[1:].split("/")[1:])
+            if cache is not None:
+                cache[path] = v
+        res.append(v)
     return res
 
 
-class ICDParser(object):
-    """Read an ate file as an xml file and parse it as pyICD object"""
-
-    def __init__(self, icd_path):
-        self.xml_root = None
-        self._icd_path = icd_path
+class ReferenceResolver(object):
+    """Get pyICD objects from ATE paths of a parsed ICD.
+    Only the ICD is referenced, so lazy reference lists can keep a resolver
+    without keeping the parser and its xml tree alive.
+    """
 
-        self.to_update = []
-        self.icd=self.eval()
+    def __init__(self, icd):
+        self._icd = icd
 
     def parse_refs(self, path):
         """Get pyICD object traveling through the given path.
@@ -55,14 +64,185 @@ class ICDParser(object):
             return current_object
         return None
 
-    def parse_device(self, xml_device):
+    def resolve_ref(self, path):
+        """Get pyICD object at the given path.
+        The path index filled while parsing is used, parse_refs is only
+        called for paths that have not been indexed.
+        Args:
+            path: tuple of icd elements name, as returned by split_paths
+        Returns: pyICD object at the given path
+        """
+        if path:
+            res = self._icd.path_index.get(path)
+            if res is None:
+                res = self.parse_refs(path)
+            return res
+        return None
+
+    def replace_refs(self, refs):
+        """Resolve a list of references
+        Args:
+            refs: list of paths, as returned by split_paths
+
+        Returns: list of the pyICD objects found
+        """
+        tmp = []
+        for ref in refs:
+            o = self.resolve_ref(ref)
+            if o is not None:
+                tmp.append(o)
+        return tmp
+
+
+class Selection(object):
+    """Devices and bus channels to parse, see ICDParser selection
+
+    The parse starts from the selected devices, and from the selected bus
+    channels when channel names or types are given, so that a channel used
+    by no selected device is parsed too.
+    """
+
+    def __init__(self, devices=None, channels=None, channel_types=None):
+        """
+        Args:
+            devices: glob patterns of the names of the selected devices, all
+                devices if None or empty
+            channels: glob patterns of the names of the selected bus channels
+            channel_types: types of the selected bus channels, channels are
+                selected by type and by name if both are given, all channels
+                if neither is given
+        """
+        self.devices = list(devices or [])
+        self.channels = list(channels or [])
+        self.channel_types = set(channel_types or [])
+
+    def __repr__(self):
+        return "Selection(devices={}, channels={}, channel_types={})".format(
+            self.devices, self.channels, sorted(self.channel_types))
+
+    def selects_channels(self):
+        """Tell whether bus channels are selected by name or type, see
+        offsets.OffsetIndex.select"""
+        return bool(self.channels or self.channel_types)
+
+    def match(self, tag, name, type_):
+        """Tell whether a device or bus child is selected, bus datas and
+        filters always are
+        Args:
+            tag: xml tag of the element
+            name, type_: name and type attributes of the element, None if missing
+        Returns: True if selected
+        """
+        if tag == "devices":
+            return not self.devices or \
+                (name is not None and any(fnmatchcase(name, p) for p in self.devices))
+        if tag == "channels":
+            if self.channel_types and type_ not in self.channel_types:
+                return False
+            return not self.channels or \
+                (name is not None and any(fnmatchcase(name, p) for p in self.channels))
+        return True
+
+
+class ICDParser(object):
+    """Read an ate file as an xml file and parse it as pyICD object"""
+
+    def __init__(self, icd_path, streaming=False, lazy=False, cache=None, indexed=False,
+                 reverse_refs=False, selection=None):
+        """
+        Args:
+            icd_path: path of the ate file
+            streaming: parse with iterparse instead of loading the whole xml
+                tree, see eval_streaming
+            lazy: do not resolve references while parsing, Device.channels,
+                Channel.datas, DataContainer.datas, Data.datas and Data.filters
+                are resolved the first time they are read
+            cache: cache.ICDCache where the parsed ICD is looked up first,
+                and stored after parsing
+            indexed: build the query.ICDIndex of the parsed ICD in self.index
+            reverse_refs: build the reverse reference index of the ICD while
+                resolving references, see ICD.get_referrers. References are
+                then resolved while parsing even if lazy is set.
+            selection: Selection of the devices and bus channels to parse,
+                see eval_selected. The ICD then only holds the selected
+                devices and bus channels and the elements they reference,
+                streaming is not used.
+        """
+        if selection is not None and cache is not None:
+            raise ValueError("An ICD parsed with a selection cannot be cached")
+        self.xml_root = None
+        self._icd_path = icd_path
+        self._streaming = streaming
+        self._lazy = lazy and not reverse_refs
+        self._reverse_refs = reverse_refs
+        self._selection = selection
+        # cache key of the parsed file content, see eval_cached
+        self.cache_key = None
+
+        self.to_update = []
+        self._split_cache = {}
+        if cache is None:
+            self.icd=self.eval()
+        else:
+            self.icd = self.eval_cached(cache)
+        if reverse_refs and self.icd.referrers is None:
+            # loaded from the cache, snapshots do not store the index
+            self.icd.build_referrers()
+
+        self.index = None
+        if indexed:
+            self.index = ICDIndex(self.icd)
+
+    def parse_refs(self, path):
+        """Get pyICD object traveling through the given path.
+        Args:
+            path: list of icd elements name to travel through
+        Returns: pyICD object at the given path
+        """
+        return self._resolver.parse_refs(path)
+
+    def resolve_ref(self, path):
+        """Get pyICD object at the given path, see ReferenceResolver
+        Args:
+            path: tuple of icd elements name, as returned by split_paths
+        Returns: pyICD object at the given path
+        """
+        return self._resolver.resolve_ref(path)
+
+    def index_path(self, path, obj):
+        """Record the ATE path of a pyICD object
+        Args:
+            path: tuple of icd elements name, None if unknown
+            obj: pyICD object
+        """
+        if path is not None:
+            self._icd.path_index[path] = obj
+
+    @staticmethod
+    def child_path(path, tag, counters):
+        """Get the ATE path of the next child with the given tag
+        Args:
+            path: parent path, None if unknown
+            tag: xml tag of the child
+            counters: dictionary of the number of children already seen by tag
+        Returns: tuple of icd elements name, None if the parent path is unknown
+        """
+        if path is None:
+            return None
+        pos = counters.get(tag, 0)
+        counters[tag] = pos + 1
+        return path + ("{}.{}".format(tag, pos),)
+
+    def parse_device(self, xml_device, path=None):
         """Parse a device from a xml node
         Args:
             xml_device: xml device node
+            path: ATE path of the device
         Returns: pyICD Device object
         """
         res = Device(self._icd.dict_index,**xml_device.attrib)
-        res.channels = split_paths(res.channels)
+        self.index_path(path, res)
+        res.channels = split_paths(res.channels, self._split_cache)
         self.to_update.append({"obj": res, "attr": "channels"})
         return res
 
@@ -74,35 +254,49 @@ class ICDParser(object):
         """
         res = Bus()
         for child in xml_bus:
-            logger.debug(f"parse_bus adding {child.tag} {child.attrib}")
-            if child.tag == "channels":
-                ch = self.parse_channel(child)
-                res.channels.append(ch)
-            elif child.tag == "datas":
-                ch = self.parse_data(child)
-                res.datas.append(ch)
-            elif child.tag == "filters":
-                ch = self.parse_filter(child)
-                res.filters.append(ch)
-            else:
-                msg = "Unknown tag '{}' for bus".format(child.tag)
-                logger.warn(msg)
+            self.parse_bus_child(res, child)
         return res
 
+    def parse_bus_child(self, bus, child):
+        """Parse a channel, data or filter node of the bus
+        Args:
+            bus: pyICD Bus object to update
+            child: xml node, child of the bus node
+        """
+        logger.debug(f"parse_bus adding {child.tag} {child.attrib}")
+        if child.tag == "channels":
+            path = ("bus", "channels.{}".format(len(bus.channels)))
+            ch = self.parse_channel(child, path)
+            bus.channels.append(ch)
+        elif child.tag == "datas":
+            path = ("bus", "datas.{}".format(len(bus.datas)))
+            ch = self.parse_data(child, path)
+            bus.datas.append(ch)
+        elif child.tag == "filters":
+            path = ("bus", "filters.{}".format(len(bus.filters)))
+            ch = self.parse_filter(child, path)
+            bus.filters.append(ch)
+        else:
+            msg = "Unknown tag '{}' for bus".format(child.tag)
+            logger.warn(msg)
+
     @staticmethod
     def parse_config(xml_conf):
         res = Config(**xml_conf.attrib)
         return res
 
-    def parse_channel(self, xml_channel):
+    def parse_channel(self, xml_channel, path=None):
         """Parse a channel from a xml node
         Args:
             xml_channel: xml channel node
+            path: ATE path of the channel
         Returns: pyICD Channel object
         """
         res = Channel(self._icd.dict_index, **xml_channel.attrib)
-        res.datas = split_paths(res.datas)
+        self.index_path(path, res)
+        res.datas = split_paths(res.datas, self._split_cache)
         self.to_update.append({"obj": res, "attr": "datas"})
+        counters = {}
         for child in xml_channel:
             logger.debug(f"parse_channel adding {child.tag} {child.attrib}")
             if child.tag == "parents":
@@ -111,25 +305,28 @@ class ICDParser(object):
                 conf = self.parse_config(child)
                 res.configs.append(conf)
             elif child.tag == "dataContainers":
-                cont = self.parse_data_container(child)
+                cont = self.parse_data_container(child, self.child_path(path, child.tag, counters))
                 res.data_containers.append(cont)
             elif child.tag == "datas":
-                ch = self.parse_data(child)
+                ch = self.parse_data(child, self.child_path(path, child.tag, counters))
                 res.datas.append(ch)
             else:
                 msg = "Unknown tag '{}' for channel".format(child.tag)
                 logger.warn(msg)
         return res
 
-    def parse_data_container(self, xml_cont):
+    def parse_data_container(self, xml_cont, path=None):
         """Parse a data container from a xml node
         Args:
             xml_cont: xml data container node
+            path: ATE path of the data container
         Returns: pyICD DataContainer object
         """
         res = DataContainer(self._icd.dict_index,**xml_cont.attrib)
-        res.datas = split_paths(res.datas)
+        self.index_path(path, res)
+        res.datas = split_paths(res.datas, self._split_cache)
         self.to_update.append({"obj": res, "attr": "datas"})
+        counters = {}
         for child in xml_cont:
             logger.debug(f"parse_data_container adding {child.tag} {child.attrib}")
             if child.tag == "parents":
@@ -138,10 +335,10 @@ class ICDParser(object):
                 conf = self.parse_config(child)
                 res.configs.append(conf)
             elif child.tag == "sublists":
-                cont = self.parse_data_container(child)
+                cont = self.parse_data_container(child, self.child_path(path, child.tag, counters))
                 res.data_containers.append(cont)
             elif child.tag == "datas":
-                ch = self.parse_data(child)
+                ch = self.parse_data(child, self.child_path(path, child.tag, counters))
                 res.datas.append(ch)
             elif child.tag == "attributes":
                 a = self.parse_attribute(child)
@@ -161,17 +358,20 @@ class ICDParser(object):
         res = DataContainerAttribute(**xml_attr.attrib)
         return res
 
-    def parse_data(self, xml_data):
+    def parse_data(self, xml_data, path=None):
         """Parse a data from a xml node
         Args:
             xml_data: xml data node
+            path: ATE path of the data
         Returns: pyICD Data object
         """
         res = Data(self._icd.dict_index,**xml_data.attrib)
-        res.filters = split_paths(res.filters)
-        res.datas = split_paths(res.datas)
+        self.index_path(path, res)
+        res.filters = split_paths(res.filters, self._split_cache)
+        res.datas = split_paths(res.datas, self._split_cache)
         self.to_update.append({"obj": res, "attr": "filters"})
         self.to_update.append({"obj": res, "attr": "datas"})
+        counters = {}
         for child in xml_data:
             logger.debug(f"parse_data adding {child.tag} {child.attrib}")
             if child.tag == "parents":
@@ -187,10 +387,10 @@ class ICDParser(object):
             elif child.tag == "parents":
                 res.parents.append(child.text)
             elif child.tag == "datas":
-                ch = self.parse_data(child)
+                ch = self.parse_data(child, self.child_path(path, child.tag, counters))
                 res.datas.append(ch)
             elif child.tag == "filters":
-                f = self.parse_filter(child)
+                f = self.parse_filter(child, self.child_path(path, child.tag, counters))
                 res.filters.append(f)
             elif child.tag == "enumElements":
                 ee = EnumElement(**child.attrib)
@@ -200,13 +400,15 @@ class ICDParser(object):
                 logger.warn(msg)
         return res
 
-    def parse_filter(self, xml_filter):
+    def parse_filter(self, xml_filter, path=None):
         """Parse a filter from a xml node
         Args:
             xml_filter: xml filter node
+            path: ATE path of the filter
         Returns: pyICD DataFilter object
         """
         res = DataFilter(self._icd.dict_index, **xml_filter.attrib)
+        self.index_path(path, res)
         for child in xml_filter:
             logger.debug(f"parse_data adding {child.tag} {child.attrib}")
             if child.tag == "configs":
@@ -234,45 +436,158 @@ class ICDParser(object):
     def replace_refs(self, refs):
         """
         Args:
-            refs:
+            refs: list of paths, as returned by split_paths
 
-        Returns:
+        Returns: list of the pyICD objects found
         """
-        tmp = []
-        for ref in refs:
-            o = self.parse_refs(ref)
-            if o is not None:
-                tmp.append(o)
-        return tmp
+        return self._resolver.replace_refs(refs)
+
+    def parse_icd_child(self, child):
+        """Parse a device or bus node, child of the ICD root node
+        Args:
+            child: xml node
+        """
+        logger.debug(f"eval adding {child.tag} {child.attrib}")
+        if child.tag == "devices":
+            path = ("devices.{}".format(len(self._icd.devices)),)
+            self._icd.devices.append(self.parse_device(child, path))
+        elif child.tag == "bus":
+            self._icd.bus = self.parse_bus(child)
+        else:
+            msg = "Unknown tag '{}' for ICD".format(child.tag)
+            logger.warn(msg)
+
+    def eval_streaming(self):
+        """Parse ICD file with iterparse.
+        Devices and bus channels, datas and filters are built as soon as their
+        end event arrives, then their xml node is removed from its parent, so
+        the whole xml tree is never held in memory.
+        """
+        stack = []
+        for event, elem in ET.iterparse(self._icd_path, events=("start", "end")):
+            if event == "start":
+                if len(stack) == 1 and elem.tag == "bus":
+                    logger.debug(f"eval adding {elem.tag} {elem.attrib}")
+                    self._icd.bus = Bus()
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if len(stack) == 1:
+                # bus children have already been consumed
+                if elem.tag != "bus":
+                    self.parse_icd_child(elem)
+                stack[0].remove(elem)
+            elif len(stack) == 2 and stack[1].tag == "bus":
+                self.parse_bus_child(self._icd.bus, elem)
+                stack[1].remove(elem)
+
+    def eval_selected(self):
+        """Parse the selected devices and bus channels and the elements they
+        reference, recursively, except the bus channels which are not
+        selected. The offset index of the file, see offsets.OffsetIndex,
+        gives the names and types of the devices and bus children without
+        building pyICD objects, and their byte ranges, so only the selected
+        closure is parsed, as by offsets.OffsetICDParser. References are
+        resolved in the closure only, references to the other elements are
+        dropped.
+        """
+        # offsets imports this module
+        from s.utest.pyicd.offsets import OffsetIndex, IndexedReferenceResolver
+
+        index = OffsetIndex.load(self._icd_path)
+        self._resolver = IndexedReferenceResolver(self._icd)
+        index.parse_closure(self, index.select(self._selection), self._selection)
+
+    def eval_cached(self, cache):
+        """Get the ICD from the cache, parse and store it if not found
+        Args:
+            cache: cache.ICDCache object
+        Returns: ICD python object
+        """
+        key = self.cache_key = cache.key(self._icd_path)
+        icd = cache.load(self._icd_path, key)
+        if icd is None:
+            icd = self.eval()
+            try:
+                cache.store(self._icd_path, icd, key)
+            except Exception as e:
+                # the cache must not fail the parse
+                logger.warning(f"Cannot store {self._icd_path} in the cache: {e}")
+        else:
+            self._icd = icd
+            self._resolver = ReferenceResolver(icd)
+        return icd
 
     def eval(self):
         """Parse ICD file as a pyICD object
         Returns: ICD python object
         """
-        tree = ET.parse(self._icd_path)
-        self.xml_root = tree.getroot()
-
         self._icd = ICD()
+        self._resolver = ReferenceResolver(self._icd)
 
-        for child in self.xml_root:
-            logger.debug(f"eval adding {child.tag} {child.attrib}")
-            if child.tag == "devices":
-                self._icd.devices.append(self.parse_device(child))
-            elif child.tag == "bus":
-                self._icd.bus = self.parse_bus(child)
-            else:
-                msg = "Unknown tag '{}' for ICD".format(child.tag)
-                logger.warn(msg)
+        if self._selection is not None:
+            self.eval_selected()
+        elif self._streaming:
+            self.eval_streaming()
+        else:
+            tree = ET.parse(self._icd_path)
+            self.xml_root = tree.getroot()
+
+            for child in self.xml_root:
+                self.parse_icd_child(child)
 
+        self.resolve_updates()
+        return self._icd
+
+    def resolve_updates(self):
+        """Resolve the references of the parsed objects listed in to_update"""
         # parse all refs
+        if self._reverse_refs:
+            self._icd.referrers = {}
         for i,update in enumerate(self.to_update):
             refs_list = getattr(update["obj"], update["attr"])
-            setattr(update["obj"], update["attr"], self.replace_refs(refs_list))
-
-        return self._icd
+            if self._lazy:
+                refs = LazyRefs(refs_list, self._resolver.replace_refs)
+            else:
+                refs = self.replace_refs(refs_list)
+                if self._reverse_refs:
+                    self._icd.add_referrers(update["obj"], update["attr"], refs)
+            setattr(update["obj"], update["attr"], refs)
+        self._split_cache.clear()
 
 if __name__ == "__main__":
-     # log in a file
-    logging.basicConfig(level=logging.DEBUG)
-    print(f"Parsing {sys.argv[1]}")
-    ICDParser(sys.argv[1])
\ No newline at end of file
+    opt_parser = optparse.OptionParser(usage="%prog [options] ICD [ICD...]")
+    opt_parser.add_option('-j', '--jobs',
+                          help='parse the files in JOBS worker processes',
+                          type='int',
+                          dest='jobs',
+                          default=0)
+    opt_parser.add_option('-m', '--max-memory',
+                          help='maximum memory of a worker process, in MB',
+                          type='int',
+                          dest='max_memory',
+                          default=None)
+    opt_parser.add_option('-l', '--log-level',
+                          dest="loglevel",
+                          default="DEBUG")
+
+    options, args = opt_parser.parse_args()
+
+    # log in a file
+    logging.basicConfig(level=options.loglevel.upper())
+
+    if options.jobs:
+        from s.utest.pyicd.batch import iter_parse_files
+        max_memory = None
+        if options.max_memory:
+            max_memory = options.max_memory * 1024 * 1024
+        for res in iter_parse_files(args, options.jobs, max_memory):
+            if res.error is None:
+                print(f"Parsed {res.path}: {len(res.icd.dict_index)} elements")
+            else:
+                print(f"Error parsing {res.path}:\n{res.error}")
+    else:
+        for arg in args:
+            print(f"Parsing {arg}")
+            ICDParser(arg)
@@ -1,26 +1,170 @@
 """
 ICD as a python object
 See ate2009.ecore file
+
+Elements use __slots__: an ICD holds millions of them, mostly Config and
+EnumElement, and a per-instance __dict__ is their main memory cost. Use
+get_fields() to list the attributes of an object.
 """
 import logging
+from sys import intern
 
 logger = logging.getLogger("ate2009-ICD-parser")
 
+# Version of the classes below, to increase when attributes are added,
+# removed or renamed. Snapshots of an other version are discarded.
+SCHEMA_VERSION = 1
+
+
+def get_value(kwargs, key, default=""):
+    """Get an ATE attribute value, strings are interned because the same
+    types, formats and properties are repeated all over the ICD
+    Args:
+        kwargs: xml attributes
+        key: attribute name
+        default: value of an absent attribute
+    Returns: attribute value
+    """
+    value = kwargs.get(key, default)
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+class CompactObject(object):
+    """Base class for pyICD objects stored in __slots__"""
+    __slots__ = ()
+
+    _fields_cache = {}
+
+    @classmethod
+    def get_fields(cls):
+        """Get the attribute names of this class, base class attributes first
+        Returns: tuple of attribute names
+        """
+        fields = CompactObject._fields_cache.get(cls)
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get("__slots__", ()):
+                    if name not in fields:
+                        fields.append(name)
+            fields = CompactObject._fields_cache[cls] = tuple(fields)
+        return fields
+
+    @classmethod
+    def get_reference_fields(cls):
+        """Get the attribute names of this class holding referenced elements
+        Returns: tuple of attribute names, see ReferenceList
+        """
+        return tuple(name for name in cls.get_fields()
+                     if isinstance(getattr(cls, name, None), ReferenceList))
+
+
 class ICD(object):
     def __init__(self, loglevel=logging.WARNING):
         self.dict_index = {}
+        # ATE path (as returned by parser.split_paths) -> element
+        self.path_index = {}
         self.devices = []
         self.bus = None
         self.name = ""
+        # referenced element -> list of (referrer, attribute name), None
+        # until built, see get_referrers
+        self.referrers = None
+        # dump options key -> {element: fingerprint of its dumped subtree},
+        # filled by icdiff.ICDDiff and stored in snapshots
+        self.fingerprints = {}
         logger.setLevel(loglevel)
 
-class Bus(object):
+    def add_referrers(self, referrer, attr, elements):
+        """Record the elements referenced by an attribute of a referrer
+        Args:
+            referrer: pyICD object
+            attr: name of the reference list attribute of 'referrer'
+            elements: list of the referenced pyICD objects
+        """
+        if self.referrers is None:
+            self.referrers = {}
+        for element in elements:
+            self.referrers.setdefault(element, []).append((referrer, attr))
+
+    def build_referrers(self):
+        """Build the reverse reference index from the reference lists of all
+        elements, resolving lazy references"""
+        self.referrers = {}
+        for element in self.dict_index.values():
+            for attr in element.get_reference_fields():
+                self.add_referrers(element, attr, getattr(element, attr))
+
+    def get_referrers(self, element):
+        """Get the elements referencing an element, for example the Devices
+        and Channels using a Data. The index is built on the first call if
+        the parser did not build it.
+        Args:
+            element: pyICD object
+        Returns: list of (referrer, attribute name)
+        """
+        if self.referrers is None:
+            self.build_referrers()
+        return self.referrers.get(element, [])
+
+class Bus(CompactObject):
+    __slots__ = ("channels", "datas", "filters")
+
     def __init__(self, **kwargs):
         self.channels = []
         self.datas = []
         self.filters = []
 
-class IndexedElement(object):
+class LazyRefs(object):
+    """References not resolved yet, stored in a ReferenceList attribute"""
+    def __init__(self, paths, resolve):
+        """
+        Args:
+            paths: list of ATE paths
+            resolve: function returning the list of pyICD objects of the paths
+        """
+        self.paths = paths
+        self.resolve = resolve
+
+
+class ReferenceList(object):
+    """Descriptor for the lists of referenced elements (Device.channels,
+    Channel.datas, ...). A LazyRefs value is resolved, and replaced by the
+    resolved list, the first time the attribute is read."""
+    def __init__(self, slot):
+        """
+        Args:
+            slot: descriptor of the __slots__ entry storing the value
+        """
+        self.slot = slot
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = self.slot.__get__(obj, objtype)
+        if isinstance(value, LazyRefs):
+            value = value.resolve(value.paths)
+            self.slot.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+
+def reference_lists(*names):
+    """Class decorator wrapping the given __slots__ entries in ReferenceList"""
+    def decorate(cls):
+        for name in names:
+            setattr(cls, name, ReferenceList(cls.__dict__[name]))
+        return cls
+    return decorate
+
+
+class IndexedElement(CompactObject):
+    __slots__ = ("_index",)
+
     def __init__(self, dict_index, **kwargs):
         self._index = int(kwargs.get("index", None))
         if self._index is None:
@@ -30,6 +174,8 @@ class IndexedElement(object):
 
 class ICDElement(IndexedElement):
     """Parent class for Device, Channel, Container, Data and Filter"""
+    __slots__ = ("_comment", "_name", "parents", "configs")
+
     def __init__(self, dict_index, **kwargs):
         super(ICDElement, self).__init__(dict_index, **kwargs)
         self._comment = kwargs.get("comment", None)
@@ -47,18 +193,22 @@ class ICDElement(IndexedElement):
     def get_index(self):
         return self._index
 
-class Config(object):
+class Config(CompactObject):
+    __slots__ = ("_property", "_value", "_type", "_comment", "_value_pattern",
+                 "_hidden", "_displayed", "_value_format", "_type_changed",
+                 "_symbols")
+
     def __init__(self, **kwargs):
-        self._property = kwargs.get("property", "")
-        self._value = kwargs.get("value", "")
-        self._type = kwargs.get("type", "")
-        self._comment = kwargs.get("comment", "")
-        self._value_pattern = kwargs.get("valuePattern", "")
-        self._hidden = kwargs.get("hidden", False)
-        self._displayed = kwargs.get("displayed", False)
-        self._value_format = kwargs.get("valueFormat", "")
-        self._type_changed = kwargs.get("typeChanged", False)
-        self._symbols = kwargs.get("symbols", "")
+        self._property = get_value(kwargs, "property")
+        self._value = get_value(kwargs, "value")
+        self._type = get_value(kwargs, "type")
+        self._comment = get_value(kwargs, "comment")
+        self._value_pattern = get_value(kwargs, "valuePattern")
+        self._hidden = get_value(kwargs, "hidden", False)
+        self._displayed = get_value(kwargs, "displayed", False)
+        self._value_format = get_value(kwargs, "valueFormat")
+        self._type_changed = get_value(kwargs, "typeChanged", False)
+        self._symbols = get_value(kwargs, "symbols")
 
     def get_property(self):
         return self._property
@@ -91,21 +241,25 @@ class Config(object):
         return self._symbols
 
 
+@reference_lists("channels")
 class Device(ICDElement):
     """Generic class for devices"""
+    __slots__ = ("channels",)
 
     def __init__(self, dict_index, **kwargs):
         ICDElement.__init__(self, dict_index, **kwargs)
         self.channels = kwargs.get("channels", "")
 
 
+@reference_lists("datas")
 class Channel(ICDElement):
     """Generic class for channels"""
+    __slots__ = ("_type", "_type_changed", "datas", "data_containers")
 
     def __init__(self, dict_index, **kwargs):
         ICDElement.__init__(self, dict_index, **kwargs)
-        self._type = kwargs.get("type", "")
-        self._type_changed = kwargs.get("typeChanged", "")
+        self._type = get_value(kwargs, "type")
+        self._type_changed = get_value(kwargs, "typeChanged")
 
         self.datas = kwargs.get("datas", "")
         self.data_containers = []
@@ -117,12 +271,14 @@ class Channel(ICDElement):
         return self._type_changed
 
 
+@reference_lists("datas")
 class DataContainer(ICDElement):
     """Generic class for containers"""
+    __slots__ = ("_type", "datas", "attributes", "data_containers")
 
     def __init__(self, dict_index, **kwargs):
         ICDElement.__init__(self, dict_index, **kwargs)
-        self._type = kwargs.get("type", "")
+        self._type = get_value(kwargs, "type")
         #Datacount is useless
         #self._data_count = kwargs.get("dataCount", 0)
 
@@ -137,15 +293,16 @@ class DataContainer(ICDElement):
     #    return self._data_count
 
 
-class DataContainerAttribute(object):
+class DataContainerAttribute(CompactObject):
     """Generic class for containers"""
+    __slots__ = ("_name", "_type", "_value", "_default_value", "_value_pattern")
 
     def __init__(self, **kwargs):
-        self._name = kwargs.get("name", "")
-        self._type = kwargs.get("type", "")
-        self._value = kwargs.get("value", "")
-        self._default_value = kwargs.get("defaultValue", "")
-        self._value_pattern = kwargs.get("valuePattern", "")
+        self._name = get_value(kwargs, "name")
+        self._type = get_value(kwargs, "type")
+        self._value = get_value(kwargs, "value")
+        self._default_value = get_value(kwargs, "defaultValue")
+        self._value_pattern = get_value(kwargs, "valuePattern")
 
 
     def get_type(self):
@@ -164,22 +321,28 @@ class DataContainerAttribute(object):
         return self._value_pattern
 
 
+@reference_lists("filters", "datas")
 class Data(ICDElement):
     """Generic class for datas"""
+    __slots__ = ("_type", "_size", "_size_format", "_min", "_min_format",
+                 "_max", "_max_format", "_default_value",
+                 "_default_value_format", "_unit", "_type_changed",
+                 "filters", "datas", "enum_elements", "channel_types",
+                 "metadatas")
 
     def __init__(self, dict_index, **kwargs):
         ICDElement.__init__(self, dict_index, **kwargs)
-        self._type = kwargs.get("type", "")
-        self._size = kwargs.get("size", 0)
-        self._size_format = kwargs.get("sizeFormat", "")
-        self._min = kwargs.get("min", "")
-        self._min_format = kwargs.get("minFormat", "")
-        self._max = kwargs.get("max", "")
-        self._max_format = kwargs.get("maxFormat", "")
-        self._default_value = kwargs.get("defaultValue", "")
-        self._default_value_format = kwargs.get("defaultValueFormat", "")
-        self._unit = kwargs.get("unit", "")
-        self._type_changed = kwargs.get("typeChanged", False)
+        self._type = get_value(kwargs, "type")
+        self._size = get_value(kwargs, "size", 0)
+        self._size_format = get_value(kwargs, "sizeFormat")
+        self._min = get_value(kwargs, "min")
+        self._min_format = get_value(kwargs, "minFormat")
+        self._max = get_value(kwargs, "max")
+        self._max_format = get_value(kwargs, "maxFormat")
+        self._default_value = get_value(kwargs, "defaultValue")
+        self._default_value_format = get_value(kwargs, "defaultValueFormat")
+        self._unit = get_value(kwargs, "unit")
+        self._type_changed = get_value(kwargs, "typeChanged", False)
 
         self.filters = kwargs.get("filters", "")
         self.datas = kwargs.get("datas", "")
@@ -221,14 +384,17 @@ class Data(ICDElement):
         return self._type_changed
 
 
-class EnumElement(object):
+class EnumElement(CompactObject):
+    __slots__ = ("_property", "_value", "_type", "_comment", "_value_pattern",
+                 "_type_changed")
+
     def __init__(self, **kwargs):
-        self._property = kwargs.get("property", "")
-        self._value = kwargs.get("value", "")
-        self._type = kwargs.get("type", "")
-        self._comment = kwargs.get("comment", "")
-        self._value_pattern = kwargs.get("valuePattern", "")
-        self._type_changed = kwargs.get("typeChanged", False)
+        self._property = get_value(kwargs, "property")
+        self._value = get_value(kwargs, "value")
+        self._type = get_value(kwargs, "type")
+        self._comment = get_value(kwargs, "comment")
+        self._value_pattern = get_value(kwargs, "valuePattern")
+        self._type_changed = get_value(kwargs, "typeChanged", False)
 
     def get_property(self):
         return self._property
@@ -251,12 +417,13 @@ class EnumElement(object):
 
 class DataFilter(ICDElement):
     """Generic class for filters and codecs"""
+    __slots__ = ("_sequence", "_sequence_format", "_type", "channel_types")
 
     def __init__(self, dict_index, **kwargs):
         ICDElement.__init__(self, dict_index, **kwargs)
-        self._sequence = kwargs.get("sequence", 0)
-        self._sequence_format = kwargs.get("sequenceFormat", "")
-        self._type = kwargs.get("type", "")
+        self._sequence = get_value(kwargs, "sequence", 0)
+        self._sequence_format = get_value(kwargs, "sequenceFormat")
+        self._type = get_value(kwargs, "type")
 
         self.channel_types = []
 
@@ -270,10 +437,12 @@ class DataFilter(ICDElement):
         return self._type
 
 
-class Metadata(object):
+class Metadata(CompactObject):
+    __slots__ = ("_key", "_value")
+
     def __init__(self, **kwargs):
-        self._key = kwargs.get("key", "")
-        self._value = kwargs.get("value", "")
+        self._key = get_value(kwargs, "key")
+        self._value = get_value(kwargs, "value")
 
     def get_key(self):
         return self._key
@@ -0,0 +1,167 @@
+"""
+Secondary indexes and queries over a parsed ICD
+
+Elements are indexed by name, hierarchical path, type, config
+property/value and metadata key. The hierarchical path of an element is
+made of the names of the elements containing it in the ate file, for example
+'bus/CHANNEL/CONTAINER/SUBLIST' or 'DEVICE'.
+"""
+import bisect
+from fnmatch import fnmatchcase
+import logging
+import optparse
+
+logger = logging.getLogger("ate2009-ICD-query")
+
+WILDCARDS = "*?["
+
+
+def _prefix(pattern):
+    """Get the part of a glob pattern before its first wildcard"""
+    for i, c in enumerate(pattern):
+        if c in WILDCARDS:
+            return pattern[:i]
+    return pattern
+
+
+class ICDIndex(object):
+    """Secondary indexes of a parsed ICD"""
+
+    def __init__(self, icd):
+        """
+        Args:
+            icd: pyICD ICD object
+        """
+        self._icd = icd
+        # key -> list of elements
+        self.by_name = {}
+        self.by_path = {}
+        self.by_type = {}
+        self.by_config = {}
+        self.by_config_property = {}
+        self.by_metadata = {}
+        # id of element -> hierarchical path
+        self._paths = {}
+
+        for ate_path, element in icd.path_index.items():
+            self._paths[id(element)] = self._name_path(ate_path)
+        for element in icd.dict_index.values():
+            self.add(element)
+        self._sorted_paths = sorted(self.by_path)
+        self._sorted_names = sorted(k for k in self.by_name if k is not None)
+
+    def _name_path(self, ate_path):
+        names = []
+        for i in range(len(ate_path)):
+            if ate_path[:i + 1] == ("bus",):
+                names.append("bus")
+                continue
+            element = self._icd.path_index.get(ate_path[:i + 1])
+            names.append(element.get_name() if element is not None else "")
+        return "/".join(names)
+
+    def add(self, element):
+        """Index an element"""
+        self.by_name.setdefault(element.get_name(), []).append(element)
+        path = self._paths.get(id(element))
+        if path is not None:
+            self.by_path.setdefault(path, []).append(element)
+        if hasattr(element, "get_type"):
+            self.by_type.setdefault(element.get_type(), []).append(element)
+        for config in element.configs:
+            key = (config.get_property(), config.get_value())
+            self.by_config.setdefault(key, []).append(element)
+            elements = self.by_config_property.setdefault(config.get_property(), [])
+            if not elements or elements[-1] is not element:
+                elements.append(element)
+        for metadata in getattr(element, "metadatas", ()):
+            elements = self.by_metadata.setdefault(metadata.get_key(), [])
+            if not elements or elements[-1] is not element:
+                elements.append(element)
+
+    def get_path(self, element):
+        """Get the hierarchical path of an element, None if unknown"""
+        return self._paths.get(id(element))
+
+    @staticmethod
+    def _glob(index, sorted_keys, pattern):
+        """Get the elements whose key matches a glob pattern"""
+        prefix = _prefix(pattern)
+        if prefix == pattern:
+            return index.get(pattern, [])
+        res = []
+        i = bisect.bisect_left(sorted_keys, prefix)
+        while i < len(sorted_keys) and sorted_keys[i].startswith(prefix):
+            if fnmatchcase(sorted_keys[i], pattern):
+                res.extend(index[sorted_keys[i]])
+            i += 1
+        return res
+
+    def select(self, path=None, name=None, type=None, config=None, metadata=None, where=None):
+        """Find elements matching all the given criteria
+        Args:
+            path: glob pattern of the hierarchical path
+            name: glob pattern of the name
+            type: type of the element
+            config: config property, or (property, value) tuple
+            metadata: metadata key
+            where: function called with each candidate element, returning
+                True to keep it
+
+        Returns: list of elements, sorted by index
+        """
+        candidates = []
+        if path is not None:
+            candidates.append(self._glob(self.by_path, self._sorted_paths, path))
+        if name is not None:
+            candidates.append(self._glob(self.by_name, self._sorted_names, name))
+        if type is not None:
+            candidates.append(self.by_type.get(type, []))
+        if config is not None:
+            if isinstance(config, tuple):
+                candidates.append(self.by_config.get(config, []))
+            else:
+                candidates.append(self.by_config_property.get(config, []))
+        if metadata is not None:
+            candidates.append(self.by_metadata.get(metadata, []))
+        if not candidates:
+            candidates.append(list(self._icd.dict_index.values()))
+
+        candidates.sort(key=len)
+        res = candidates[0]
+        for other in candidates[1:]:
+            ids = set(id(e) for e in other)
+            res = [e for e in res if id(e) in ids]
+        if where is not None:
+            res = [e for e in res if where(e)]
+        # the same element may be found through several keys
+        unique = {}
+        for e in res:
+            unique[id(e)] = e
+        return sorted(unique.values(), key=lambda e: e.get_index())
+
+
+if __name__ == "__main__":
+    from s.utest.pyicd.parser import ICDParser
+
+    opt_parser = optparse.OptionParser(usage="%prog [options] ICD")
+    opt_parser.add_option('-p', '--path', dest='path', default=None,
+                          help='glob pattern of the hierarchical path')
+    opt_parser.add_option('-n', '--name', dest='name', default=None,
+                          help='glob pattern of the name')
+    opt_parser.add_option('-t', '--type', dest='type', default=None,
+                          help='type of the elements')
+    opt_parser.add_option('-c', '--config', dest='config', default=None,
+                          help='config property, or property=value')
+    opt_parser.add_option('-m', '--metadata', dest='metadata', default=None,
+                          help='metadata key')
+
+    options, args = opt_parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    config = options.config
+    if config is not None and "=" in config:
+        config = tuple(config.split("=", 1))
+    index = ICDParser(args[0], indexed=True).index
+    for element in index.select(options.path, options.name, options.type, config, options.metadata):
+        print(f"{index.get_path(element)} ({type(element).__name__} {element.get_index()})")
@@ -0,0 +1,178 @@
+"""
+Binary snapshot of a parsed ICD
+
+The object graph is flattened before being pickled: every indexed element is
+stored once in a table and referenced by its position in this table, other
+pyICD objects (Config, EnumElement, ...) are stored inline as tuples.
+References are resolved when the snapshot is taken. The subtree
+fingerprints of the indexed elements, see icdiff, are stored as well.
+"""
+import logging
+import pickle
+
+from s.utest.pyicd import pyICD
+from s.utest.pyicd.pyICD import ICD, IndexedElement, CompactObject, SCHEMA_VERSION
+
+logger = logging.getLogger("ate2009-ICD-snapshot")
+
+MAGIC = "pyICD-snapshot"
+
+
+class SnapshotError(ValueError):
+    """Snapshot can not be read by this version of pyICD"""
+
+
+class _Encoder(object):
+    def __init__(self):
+        self.classes = []
+        self.class_ids = {}
+        self.elements = []
+        self.element_ids = {}
+
+    def class_id(self, obj):
+        cls = type(obj)
+        res = self.class_ids.get(cls)
+        if res is None:
+            res = self.class_ids[cls] = len(self.classes)
+            self.classes.append((cls.__name__, cls.get_fields()))
+        return res
+
+    def element_id(self, element):
+        res = self.element_ids.get(id(element))
+        if res is None:
+            res = self.element_ids[id(element)] = len(self.elements)
+            self.elements.append(element)
+        return res
+
+    def encode_object(self, obj):
+        res = [self.class_id(obj)]
+        for name in obj.get_fields():
+            res.append(self.encode_value(getattr(obj, name)))
+        return tuple(res)
+
+    def encode_value(self, value):
+        if isinstance(value, list):
+            res = []
+            for v in value:
+                if isinstance(v, IndexedElement):
+                    res.append(self.element_id(v))
+                elif isinstance(v, CompactObject):
+                    res.append(self.encode_object(v))
+                elif v is None or isinstance(v, str):
+                    res.append(v)
+                elif isinstance(v, (bool, int, float)):
+                    # integers are element ids
+                    res.append([v])
+                else:
+                    raise SnapshotError("Can not store {!r} in a list".format(v))
+            return res
+        if isinstance(value, CompactObject):
+            return self.encode_object(value)
+        return value
+
+    def encode(self, icd):
+        index = [self.element_id(e) for e in icd.dict_index.values()]
+        paths = [(path, self.element_id(e)) for path, e in icd.path_index.items()]
+        devices = self.encode_value(icd.devices)
+        bus = self.encode_value(icd.bus)
+        fingerprints = {key: [(self.element_id(e), digest) for e, digest in table.items()
+                              if isinstance(e, IndexedElement)]
+                        for key, table in icd.fingerprints.items()}
+        # elements found while encoding are appended to the table
+        encoded = []
+        i = 0
+        while i < len(self.elements):
+            encoded.append(self.encode_object(self.elements[i]))
+            i += 1
+        return {"classes": self.classes,
+                "elements": encoded,
+                "dict_index": index,
+                "path_index": paths,
+                "devices": devices,
+                "bus": bus,
+                "fingerprints": fingerprints,
+                "name": icd.name}
+
+
+class _Decoder(object):
+    def __init__(self, classes):
+        self.classes = []
+        for name, fields in classes:
+            cls = getattr(pyICD, name, None)
+            if cls is None or cls.get_fields() != tuple(fields):
+                raise SnapshotError("pyICD class {} has changed".format(name))
+            self.classes.append(cls)
+        self.elements = []
+
+    def new(self, encoded):
+        cls = self.classes[encoded[0]]
+        return cls.__new__(cls)
+
+    def fill(self, obj, encoded):
+        for name, value in zip(obj.get_fields(), encoded[1:]):
+            setattr(obj, name, self.decode_value(value))
+        return obj
+
+    def decode_value(self, value):
+        if isinstance(value, list):
+            res = []
+            for v in value:
+                if isinstance(v, int):
+                    res.append(self.elements[v])
+                elif isinstance(v, tuple):
+                    res.append(self.fill(self.new(v), v))
+                elif isinstance(v, list):
+                    res.append(v[0])
+                else:
+                    res.append(v)
+            return res
+        if isinstance(value, tuple):
+            return self.fill(self.new(value), value)
+        return value
+
+    def decode(self, data):
+        # create all elements first, they reference each other
+        self.elements = [self.new(e) for e in data["elements"]]
+        for element, encoded in zip(self.elements, data["elements"]):
+            self.fill(element, encoded)
+
+        icd = ICD()
+        for i in data["dict_index"]:
+            element = self.elements[i]
+            icd.dict_index[element.get_index()] = element
+        for path, i in data["path_index"]:
+            icd.path_index[path] = self.elements[i]
+        icd.devices = self.decode_value(data["devices"])
+        icd.bus = self.decode_value(data["bus"])
+        icd.name = data["name"]
+        for key, items in data.get("fingerprints", {}).items():
+            icd.fingerprints[key] = {self.elements[i]: digest for i, digest in items}
+        return icd
+
+
+def dumps(icd):
+    """Get the snapshot of an ICD
+    Args:
+        icd: pyICD ICD object
+    Returns: bytes
+    """
+    data = _Encoder().encode(icd)
+    return pickle.dumps((MAGIC, SCHEMA_VERSION, data), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def loads(snapshot):
+    """Rebuild an ICD from its snapshot
+    Args:
+        snapshot: bytes returned by dumps
+    Returns: pyICD ICD object
+    Raises: SnapshotError if the snapshot is not readable by this pyICD version
+    """
+    try:
+        magic, version, data = pickle.loads(snapshot)
+    except Exception as e:
+        raise SnapshotError("Invalid snapshot: {}".format(e))
+    if magic != MAGIC:
+        raise SnapshotError("Not a pyICD snapshot")
+    if version != SCHEMA_VERSION:
+        raise SnapshotError("Snapshot version {} instead of {}".format(version, SCHEMA_VERSION))
+    return _Decoder(data["classes"]).decode(data)
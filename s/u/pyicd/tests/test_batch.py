@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from s.utest.pyicd.batch import parse_files
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class CrashingCache(object):
+    """ICDCache stand-in whose worker process dies on the files named crash.ate"""
+
+    def key(self, icd_path):
+        if os.path.basename(icd_path) == "crash.ate":
+            os._exit(3)
+        return None
+
+    def load(self, icd_path, key):
+        return None
+
+    def store(self, icd_path, icd, key):
+        pass
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sample = os.path.join(DATA, "sample.ate")
+        self.crash = os.path.join(self.tmp, "crash.ate")
+        shutil.copy(self.sample, self.crash)
+        self.bad = os.path.join(self.tmp, "bad.ate")
+        with open(self.bad, "w") as f:
+            f.write("<ICD>")
+
+    def test_errors_are_per_file(self):
+        paths = [self.sample, self.bad, self.sample, self.crash, self.sample]
+        results = parse_files(paths, jobs=2, cache=CrashingCache())
+        self.assertEqual([res.path for res in results], paths)
+        for res in results[0::2]:
+            self.assertIsNone(res.error)
+            self.assertEqual(len(res.icd.devices), 3)
+        self.assertIn("ParseError", results[1].error)
+        self.assertIn("exited with code 3", results[3].error)
+        self.assertIsNone(results[3].icd)
+
+    def test_worker_death_does_not_fail_the_next_files(self):
+        results = parse_files([self.crash] + [self.sample] * 3, jobs=1, cache=CrashingCache())
+        self.assertIsNotNone(results[0].error)
+        self.assertTrue(all(res.error is None for res in results[1:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from s.utest.pyicd import extsort, snapshot
+from s.utest.pyicd.cache import ICDCache
+from s.utest.pyicd.icdump import ICDDumper, get_option_parser
+from s.utest.pyicd.parser import ICDParser
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class TestDumpModes(unittest.TestCase):
+    """The parse and dump modes give the dump of the DOM parse"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sample = os.path.join(self.tmp, "sample.ate")
+        shutil.copy(os.path.join(DATA, "sample.ate"), self.sample)
+        self.expected = self.dump(self.sample)
+        self.assertIn("DEV1/CH1", self.expected)
+
+    def dump(self, icd, max_memory=None, **options):
+        """Dump an ate file or an ICD with the default options updated by
+        'options'
+        Returns: list of lines
+        """
+        values = get_option_parser().get_default_values()
+        for name, value in options.items():
+            setattr(values, name, value)
+        output = os.path.join(self.tmp, "dump.txt")
+        dumper = ICDDumper(icd, values)
+        if max_memory is None:
+            dumper.dump(output)
+        else:
+            dumper.dump(output, max_memory)
+        with open(output, encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_streaming(self):
+        self.assertEqual(self.dump(self.sample, streaming=True), self.expected)
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.tmp, "cache")
+        # stored by the first dump, loaded by the second
+        self.assertEqual(self.dump(self.sample, cache_dir=cache_dir), self.expected)
+        self.assertTrue(os.listdir(cache_dir))
+        self.assertEqual(self.dump(self.sample, cache_dir=cache_dir), self.expected)
+
+    def test_external_sort(self):
+        # one run per string, merged by levels of extsort.MAX_RUNS runs
+        with mock.patch.object(extsort, "MIN_RUN_LENGTH", 1):
+            self.assertEqual(self.dump(self.sample, max_memory=0), self.expected)
+
+    def test_lazy(self):
+        icd = ICDParser(self.sample, lazy=True).icd
+        self.assertEqual(self.dump(icd), self.expected)
+
+
+class TestCache(unittest.TestCase):
+    """Parse through the cache an ICD whose lists hold None items"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache = ICDCache(os.path.join(self.tmp, "cache"))
+        with open(os.path.join(DATA, "sample.ate"), encoding="utf-8") as f:
+            content = f.read()
+        # empty elements have no text
+        content = content.replace("<parents>p1</parents>", "<parents/>")
+        content = content.replace("<channelTypes>A429</channelTypes>", "<channelTypes/>")
+        self.sample = os.path.join(self.tmp, "sample.ate")
+        with open(self.sample, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def test_empty_list_items(self):
+        icd = ICDParser(self.sample, cache=self.cache).icd
+        self.assertEqual(icd.dict_index[21].parents, [None])
+        self.assertEqual(icd.dict_index[18].channel_types, [None])
+        self.assertTrue(os.listdir(self.cache.directory))
+
+        cached = ICDParser(self.sample, cache=self.cache).icd
+        self.assertIsNot(cached, icd)
+        self.assertEqual(cached.dict_index[21].parents, [None])
+        self.assertEqual(cached.dict_index[18].channel_types, [None])
+
+    def test_store_failure(self):
+        with mock.patch.object(snapshot, "dumps", side_effect=snapshot.SnapshotError("broken")):
+            icd = ICDParser(self.sample, cache=self.cache).icd
+        self.assertEqual(icd.dict_index[21].get_name(), "F1")
+        self.assertFalse(os.path.exists(self.cache.directory) and
+                         os.listdir(self.cache.directory))
+
+
+if __name__ == "__main__":
+    unittest.main()
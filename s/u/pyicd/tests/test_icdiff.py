@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from s.utest.pyicd.cache import ICDCache
+from s.utest.pyicd.icdiff import ICDDiff, fingerprint_key
+from s.utest.pyicd.options import get_option_parser
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+DEV1 = '<devices index="2" name="DEV1" channels="//@bus/@channels.1"/>\n'
+
+
+class TestICDDiff(unittest.TestCase):
+    """Differences between sample.ate and edited copies of it"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        with open(os.path.join(DATA, "sample.ate"), encoding="utf-8") as f:
+            self.content = f.read()
+        self.sample = self.write("sample.ate", self.content)
+        self.options = get_option_parser().get_default_values()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def diff(self, old, new):
+        """Compare sample.ate with a copy where 'old' is replaced by 'new'"""
+        self.assertIn(old, self.content)
+        edited = self.write("edited.ate", self.content.replace(old, new))
+        return ICDDiff(self.sample, edited, self.options).diff()
+
+    def test_same(self):
+        result = ICDDiff(self.sample, self.sample, self.options).diff()
+        self.assertEqual(result, ([], [], []))
+
+    def test_added(self):
+        result = self.diff("  <bus>\n", '  <devices index="22" name="DEV3"/>\n  <bus>\n')
+        self.assertEqual(result, (["DEV3"], [], []))
+        result = self.diff(DEV1, DEV1.replace('"//@bus/@channels.1"',
+                                              '"//@bus/@channels.1 //@bus/@channels.2"'))
+        self.assertEqual(result, (["DEV1/CH2"], [], []))
+
+    def test_removed(self):
+        result = self.diff(DEV1, "")
+        self.assertEqual(result, ([], ["DEV1"], []))
+
+    def test_changed(self):
+        result = self.diff('name="D2" type="FLOAT" size="32"', 'name="D2" type="FLOAT" size="64"')
+        self.assertEqual(result, ([], [], [("DEV0/CH0/VL0/D2", ["/size:32"], ["/size:64"]),
+                                           ("DEV2/CH0/VL0/D2", ["/size:32"], ["/size:64"])]))
+
+
+class TestStoreFingerprints(unittest.TestCase):
+    """Fingerprints are only stored in the cache on request, under the key
+    of the parsed content"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sample = os.path.join(self.tmp, "sample.ate")
+        shutil.copy(os.path.join(DATA, "sample.ate"), self.sample)
+        self.options = get_option_parser().get_default_values()
+        self.options.cache_dir = os.path.join(self.tmp, "cache")
+        self.cache = ICDCache(self.options.cache_dir)
+        self.key = fingerprint_key(self.options)
+
+    def test_not_stored_by_default(self):
+        ICDDiff(self.sample, self.sample, self.options).diff()
+        self.assertEqual(self.cache.load(self.sample).fingerprints, {})
+
+    def test_stored(self):
+        self.options.store_fingerprints = True
+        ICDDiff(self.sample, self.sample, self.options).diff()
+        self.assertTrue(self.cache.load(self.sample).fingerprints[self.key])
+
+    def test_modified_file(self):
+        self.options.store_fingerprints = True
+        c = ICDDiff(self.sample, self.sample, self.options)
+        key = self.cache.key(self.sample)
+        with open(self.sample, "a", encoding="utf-8") as f:
+            f.write("\n")
+        c.diff()
+        # stored under the key of the parsed content only
+        self.assertTrue(self.cache.load(self.sample, key).fingerprints[self.key])
+        self.assertIsNone(self.cache.load(self.sample))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from s.utest.pyicd.icdserver import ICDStore
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class TestICDStore(unittest.TestCase):
+    """Only the ICDs parsed successfully are kept"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sample = os.path.join(self.tmp, "sample.ate")
+        shutil.copy(os.path.join(DATA, "sample.ate"), self.sample)
+        self.malformed = os.path.join(self.tmp, "malformed.ate")
+        with open(self.malformed, "w", encoding="utf-8") as f:
+            f.write("<ICD><devices name='DEV0'>")
+        self.store = ICDStore(max_icds=1)
+
+    def test_parse_error(self):
+        self.store.get(self.sample)
+        with self.assertRaises(ET.ParseError):
+            self.store.get(self.malformed)
+        # the failed parse did not evict the sample
+        self.assertEqual(self.store.paths(), [self.sample])
+
+    def test_missing_file(self):
+        with self.assertRaises(OSError):
+            self.store.get(os.path.join(self.tmp, "missing.ate"))
+        self.assertEqual(self.store.paths(), [])
+
+    def test_file_broken_since_parsed(self):
+        loaded = self.store.get(self.sample)
+        self.assertIs(self.store.get(self.sample), loaded)
+        shutil.copy(self.malformed, self.sample)
+        with self.assertRaises(ET.ParseError):
+            self.store.get(self.sample)
+        self.assertEqual(self.store.paths(), [])
+
+    def test_eviction(self):
+        copy = os.path.join(self.tmp, "copy.ate")
+        shutil.copy(self.sample, copy)
+        self.store.get(self.sample)
+        self.store.get(copy)
+        self.assertEqual(self.store.paths(), [copy])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from s.utest.pyicd.offsets import OffsetIndex, OffsetICDParser
+from s.utest.pyicd.parser import ICDParser, Selection
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def names(objs):
+    return sorted(obj.get_name() for obj in objs)
+
+
+class TestSelection(unittest.TestCase):
+
+    def setUp(self):
+        # the offset index is saved next to the ate file
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sample = os.path.join(self.tmp, "sample.ate")
+        shutil.copy(os.path.join(DATA, "sample.ate"), self.sample)
+
+    def test_devices(self):
+        icd = ICDParser(self.sample, selection=Selection(devices=["DEV1"])).icd
+        self.assertEqual(names(icd.devices), ["DEV1"])
+        self.assertEqual(names(icd.devices[0].channels), ["CH1"])
+        # CH1 references a port of CH0, which is parsed with it
+        self.assertEqual(names(icd.bus.channels), ["CH0", "CH1"])
+
+    def test_unused_channel(self):
+        icd = ICDParser(self.sample, selection=Selection(devices=["DEV1"], channels=["CH3"])).icd
+        self.assertEqual(names(icd.devices), ["DEV1"])
+        self.assertEqual(names(icd.devices[0].channels), [])
+        self.assertEqual(names(icd.bus.channels), ["CH3"])
+
+    def test_channel_type(self):
+        icd = ICDParser(self.sample, selection=Selection(channel_types=["CAN"])).icd
+        self.assertEqual(names(icd.devices), ["DEV0", "DEV1", "DEV2"])
+        self.assertEqual(names(icd.bus.channels), ["CH2", "CH3"])
+
+    def test_paths(self):
+        index = OffsetIndex.load(self.sample)
+        path = next(entry.path for entry in index.entries if entry.name == "CH3")
+        icd = OffsetICDParser(self.sample, [path], index).icd
+        self.assertEqual(icd.devices, [])
+        self.assertEqual(names(icd.bus.channels), ["CH3"])
+        self.assertIs(icd.path_index[path], icd.bus.channels[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import unittest
+
+from s.utest.pyicd.parser import ICDParser
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class TestSelect(unittest.TestCase):
+    """Selections of ICDIndex on sample.ate"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index = ICDParser(os.path.join(DATA, "sample.ate"), indexed=True).index
+
+    def select(self, **criteria):
+        """Returns: the paths of the elements selected by 'criteria'"""
+        return [self.index.get_path(e) for e in self.index.select(**criteria)]
+
+    def test_config(self):
+        self.assertEqual(self.select(config=("GUID", "DG0")), ["bus/D0"])
+        self.assertEqual(self.select(config=("GUID", "GP0")), ["bus/CH0/VL0/P0"])
+        self.assertEqual(self.select(config=("Label", "L0")), ["bus/D0"])
+        self.assertEqual(self.select(config="GUID"),
+                         ["bus/CH0", "bus/CH0/VL0/P0", "bus/CH1", "bus/CH2", "bus/CH3",
+                          "bus/D0", "bus/D1", "bus/D2", "bus/D4"])
+
+    def test_path(self):
+        self.assertEqual(self.select(path="bus/CH0/*"),
+                         ["bus/CH0/VL0", "bus/CH0/VL0/P0", "bus/CH0/VL0/P1",
+                          "bus/CH0/VL0/P1/P1_0"])
+        self.assertEqual(self.select(path="bus/CH0/VL0/P1*"),
+                         ["bus/CH0/VL0/P1", "bus/CH0/VL0/P1/P1_0"])
+        self.assertEqual(self.select(path="DEV*"), ["DEV0", "DEV1", "DEV2"])
+
+    def test_type(self):
+        self.assertEqual(self.select(type="CAN"), ["bus/CH2", "bus/CH3"])
+        self.assertEqual(self.select(type="INT"), ["bus/D0", "bus/D3", "bus/D4"])
+
+    def test_combined(self):
+        self.assertEqual(self.select(type="INT", config="GUID"), ["bus/D0", "bus/D4"])
+        self.assertEqual(self.select(path="bus/*", type="CAN", name="CH3"), ["bus/CH3"])
+
+    def test_no_match(self):
+        self.assertEqual(self.select(config=("GUID", "unknown")), [])
+        self.assertEqual(self.select(path="unknown/*"), [])
+        self.assertEqual(self.select(type="unknown"), [])
+        self.assertEqual(self.select(type="CAN", name="CH0"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
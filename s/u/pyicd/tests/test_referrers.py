@@ -0,0 +1,48 @@
+import os
+import unittest
+
+from s.utest.pyicd.parser import ICDParser
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample.ate")
+
+
+class TestReferrers(unittest.TestCase):
+    """ICD.get_referrers on sample.ate, whatever the way it is parsed"""
+
+    def referrers(self, index, **options):
+        """Returns: sorted (referrer name, attribute) of the element of
+        sample.ate at 'index', parsed with 'options'
+        """
+        icd = ICDParser(SAMPLE, **options).icd
+        return sorted((referrer.get_name(), attr)
+                      for referrer, attr in icd.get_referrers(icd.dict_index[index]))
+
+    def check(self, **options):
+        # D0 is used by a channel and by a data
+        self.assertEqual(self.referrers(13, **options), [("CH0", "datas"), ("D1", "datas")])
+        # F0 is used by the filters of two datas
+        self.assertEqual(self.referrers(20, **options), [("D0", "filters"), ("D1", "filters")])
+        # D2 is used by a channel and by a data container
+        self.assertEqual(self.referrers(17, **options), [("CH2", "datas"), ("VL0", "datas")])
+        # CH3 is used by no device
+        self.assertEqual(self.referrers(12, **options), [])
+
+    def test_eager(self):
+        self.check()
+
+    def test_eager_reverse_refs(self):
+        self.check(reverse_refs=True)
+
+    def test_lazy(self):
+        self.check(lazy=True)
+
+    def test_lazy_reverse_refs(self):
+        self.check(lazy=True, reverse_refs=True)
+
+    def test_built_while_parsing(self):
+        self.assertIsNone(ICDParser(SAMPLE, lazy=True).icd.referrers)
+        self.assertIsNotNone(ICDParser(SAMPLE, lazy=True, reverse_refs=True).icd.referrers)
+
+
+if __name__ == "__main__":
+    unittest.main()
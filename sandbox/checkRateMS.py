@@ -2,10 +2,56 @@ import pandas as pd
 import numpy as np
 import argparse
 import logging
+import multiprocessing
+import os
+import pathlib
+import sqlite3
+from contextlib import closing
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def process_csv(utest_file, av_file, output_file, stop_after_merge=False):
+# Columns of the av rows inherited from their class
+INHERITED_COLUMNS = ['Direction', 'SamplePeriod', 'RefreshPeriod']
+
+# Default number of utest rows checked at once against an av store
+DEFAULT_CHUNK_SIZE = 100000
+
+# Maximum number of Guid looked up in the av store by a single query
+MAX_QUERY_GUIDS = 900
+
+def inherit_class_values(av, report_file=None):
+    '''
+    This function copies the inherited columns of the class rows (rows with a null GuidDef) into the
+    instance rows whose GuidDef is the Guid of a class, in a single lookup instead of a scan of av
+    per instance.
+
+    Parameters:
+    av (DataFrame): The av data, updated in place.
+    report_file (str, optional): The path to a CSV file where the inherited columns of the updated
+        rows are written, before and after the update.
+
+    Returns:
+    None
+    '''
+    classes = av[av['GuidDef'].isnull()].set_index('Guid')[INHERITED_COLUMNS]
+    if not classes.index.is_unique:
+        raise ValueError('Guid of the class rows must be unique')
+
+    instances = av['GuidDef'].notnull() & av['GuidDef'].isin(classes.index)
+    guid_defs = av.loc[instances, 'GuidDef']
+    before = av.loc[instances, ['Guid', 'GuidDef'] + INHERITED_COLUMNS]
+    for column in INHERITED_COLUMNS:
+        av.loc[instances, column] = guid_defs.map(classes[column])
+    logging.info(f"Updated {len(guid_defs)} rows from their GuidDef")
+
+    if report_file:
+        report = before[['Guid', 'GuidDef']].copy()
+        for column in INHERITED_COLUMNS:
+            report[f'{column} before'] = before[column]
+            report[f'{column} after'] = av.loc[instances, column]
+        report.to_csv(report_file, index=False)
+
+def process_csv(utest_file, av_file, output_file, stop_after_merge=False, report_file=None):
     '''
     This function takes two CSV files, merges them based on a common column, and creates new columns based on specified conditions.
     The final DataFrame is either written into a new CSV file or printed to the console.
@@ -15,6 +61,8 @@ def process_csv(utest_file, av_file, output_file, stop_after_merge=False):
     av_file (str): The path to the second CSV file.
     output_file (str, optional): The path to the output CSV file. If None, the result is printed to the console.
     stop_after_av (bool, optional): If True, the script stops after processing the av_file and writes the result into the output_file.
+    report_file (str, optional): The path to the CSV report of the av rows updated from their
+        GuidDef.
 
     Returns:
     None
@@ -23,26 +71,9 @@ def process_csv(utest_file, av_file, output_file, stop_after_merge=False):
     # Load data
     utest = pd.read_csv(utest_file)
     av = pd.read_csv(av_file)
-    
-    # Add new column 'isRateNull'
-    utest['isRateNull'] = utest['Rate (ms)'].apply(lambda x: 'true' if x == 0.0 else '_')
-
-    # Create dictionary for GuidDef with non-null values, indexed by Guid
-    class_dict = av[av['GuidDef'].isnull()].set_index('Guid')[['Direction', 'SamplePeriod', 'RefreshPeriod']].to_dict('index')
 
-    # Iterate through the rows in av with non-null GuidDef
-    for _, instance in av[av['GuidDef'].notnull()].iterrows():
-        if instance['GuidDef'] in class_dict:
-            # Save original values for logging
-            original_values = av.loc[av['GuidDef'] == instance['GuidDef'], ['Direction', 'SamplePeriod', 'RefreshPeriod']].values[0]
-
-            # Update rows where GuidDef equals Guid of the current row with values from class_dict
-            av.loc[av['GuidDef'] == instance['GuidDef'], ['Direction', 'SamplePeriod', 'RefreshPeriod']] = list(class_dict[instance['GuidDef']].values())
-
-            # Log the changes
-            logging.info(f"Updated row for GuidDef {instance['GuidDef']}:")
-            logging.info(f"Before: Direction = {original_values[0]}, SamplePeriod = {original_values[1]}, RefreshPeriod = {original_values[2]}")
-            logging.info(f"After: Direction = {class_dict[instance['GuidDef']]['Direction']}, SamplePeriod = {class_dict[instance['GuidDef']]['SamplePeriod']}, RefreshPeriod = {class_dict[instance['GuidDef']]['RefreshPeriod']}")
+    # Inherit the values of the classes into their instances
+    inherit_class_values(av, report_file)
 
     if stop_after_merge:
         if output_file:
@@ -51,8 +82,34 @@ def process_csv(utest_file, av_file, output_file, stop_after_merge=False):
             print(av)
         return
 
+    merged = check_rates(utest, av)
+
+    # Write the final DataFrame into a new CSV file or print to console
+    if output_file:
+        merged.to_csv(output_file, index=False)
+    else:
+        print(merged)
+
+def check_rates(utest, av, lookup=None):
+    '''
+    This function merges utest rows with the av data and creates the check columns.
+
+    Parameters:
+    utest (DataFrame): The utest data, the 'isRateNull' column is added to it.
+    av (DataFrame): The av data, with the values inherited from the classes.
+    lookup (DataFrame, optional): The av data indexed by Guid, see av_lookup, used instead of av.
+
+    Returns:
+    DataFrame: The utest rows with their av columns and the check columns.
+    '''
+    # Add new column 'isRateNull'
+    utest['isRateNull'] = utest['Rate (ms)'].apply(lambda x: 'true' if x == 0.0 else '_')
+
     # Merge the two DataFrames based on the GUID/Guid column, keep all rows from 'utest' (left join)
-    merged = pd.merge(utest, av, left_on='GUID', right_on='Guid', how='left')
+    if lookup is None:
+        merged = pd.merge(utest, av, left_on='GUID', right_on='Guid', how='left')
+    else:
+        merged = pd.merge(utest, lookup, left_on='GUID', right_index=True, how='left')
 
     # Replace NaN values in specified columns with 'Not Found'
     merged[['FileName', 'Direction', 'SamplePeriod', 'RefreshPeriod']] = merged[['FileName', 'Direction', 'SamplePeriod', 'RefreshPeriod']].fillna('Not Found')
@@ -61,23 +118,320 @@ def process_csv(utest_file, av_file, output_file, stop_after_merge=False):
     merged['isSample'] = np.where(merged['Rate (ms)'] == merged['SamplePeriod'], 'true', '')
     merged['isRefresh'] = np.where(merged['Rate (ms)'] == merged['RefreshPeriod'], 'true', '')
     merged['Bilan'] = np.where((merged['isSample'] == 'true') | (merged['isRefresh'] == 'true'), 'OK', 'KO')
+    return merged
 
-    # Write the final DataFrame into a new CSV file or print to console
-    if output_file:
-        merged.to_csv(output_file, index=False)
+def av_lookup(av, missing=False):
+    '''
+    This function indexes the av data by Guid, so that it is hashed once instead of at every merge.
+
+    Parameters:
+    av (DataFrame): The av data, with the values inherited from the classes.
+    missing (bool, optional): If True, some utest rows of the whole file have no av row, see
+        scan_utest. The integer columns are then stored as floats, like in a merge of the whole
+        file, whatever the chunk.
+
+    Returns:
+    DataFrame: The av data indexed by Guid.
+    '''
+    lookup = av.copy()
+    lookup.index = pd.Index(av['Guid'].values)
+    if missing:
+        for column in lookup.columns:
+            if pd.api.types.is_integer_dtype(lookup[column]):
+                lookup[column] = lookup[column].astype(float)
+    return lookup
+
+def common_dtype(dtype1, dtype2):
+    '''
+    Returns:
+    The type pandas infers for a column when reading two chunks of it at once, their types being
+    dtype1 and dtype2.
+    '''
+    if dtype1 == dtype2:
+        return dtype1
+    numbers = [pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_float_dtype(dtype)
+               for dtype in (dtype1, dtype2)]
+    if all(numbers):
+        return np.dtype(float)
+    return str
+
+def scan_utest(utest_file, chunk_size, is_found):
+    '''
+    This function reads the utest file by chunks once, to find the types of its columns as pandas
+    infers them from the whole file, and whether some utest rows have no av row. The chunks are then
+    read and merged with these types, so that their values are written like in process_csv: a chunk
+    alone may hold integers only where the whole file has decimals or missing values.
+
+    Parameters:
+    utest_file (str): The path to the utest CSV file.
+    chunk_size (int): The number of utest rows read at once.
+    is_found (callable): Called with the 'GUID' column of each chunk, returns for each row True if
+        it has an av row.
+
+    Returns:
+    tuple: The types of the utest columns by name, and True if some utest rows have no av row.
+    '''
+    dtypes = {}
+    missing = False
+    for utest in pd.read_csv(utest_file, chunksize=chunk_size):
+        for name, dtype in utest.dtypes.items():
+            dtypes[name] = common_dtype(dtypes[name], dtype) if name in dtypes else dtype
+        missing = missing or not is_found(utest['GUID']).all()
+    return dtypes, missing
+
+def process_csv_chunked(utest_file, av_file, output_file, chunk_size, report_file=None):
+    '''
+    This function checks utest rows like process_csv, reading the utest file by chunks of rows and
+    appending the result of each chunk to the output file, so that the memory used does not depend
+    on the number of utest rows. Only the av data is fully loaded. The utest file is read twice, see
+    scan_utest.
+
+    Parameters:
+    utest_file (str): The path to the first CSV file.
+    av_file (str): The path to the second CSV file.
+    output_file (str): The path to the output CSV file.
+    chunk_size (int): The number of utest rows checked at once.
+    report_file (str, optional): The path to the CSV report of the av rows updated from their
+        GuidDef.
+
+    Returns:
+    None
+    '''
+    av = pd.read_csv(av_file)
+    inherit_class_values(av, report_file)
+    dtypes, missing = scan_utest(utest_file, chunk_size, lambda guids: guids.isin(av['Guid']))
+    lookup = av_lookup(av, missing)
+
+    write_chunks(utest_file, output_file, chunk_size, dtypes, lambda utest: lookup)
+
+def write_chunks(utest_file, output_file, chunk_size, dtypes, get_lookup):
+    '''
+    This function checks the utest file by chunks of rows and appends the result of each chunk to
+    the output file.
+
+    Parameters:
+    utest_file (str): The path to the utest CSV file.
+    output_file (str): The path to the output CSV file.
+    chunk_size (int): The number of utest rows checked at once.
+    dtypes (dict): The types of the utest columns, see scan_utest.
+    get_lookup (callable): Called with each chunk of utest rows, returns the av data indexed by
+        Guid, see av_lookup.
+
+    Returns:
+    None
+    '''
+    rows = 0
+    header = True
+    for utest in pd.read_csv(utest_file, chunksize=chunk_size, dtype=dtypes):
+        merged = check_rates(utest, None, get_lookup(utest))
+        merged.to_csv(output_file, index=False, header=header, mode='w' if header else 'a')
+        header = False
+        rows += len(utest)
+        logging.info(f"Checked {rows} utest rows of {utest_file}")
+    if header:
+        # empty utest file
+        utest = pd.read_csv(utest_file)
+        check_rates(utest, None, get_lookup(utest)).to_csv(output_file, index=False)
+
+def build_av_store(av_file, store_file, report_file=None):
+    '''
+    This function resolves the av data once and saves it in a SQLite file indexed by Guid, with the
+    types of its columns and the modification time and size of the av file it comes from.
+
+    Parameters:
+    av_file (str): The path to the av CSV file.
+    store_file (str): The path to the SQLite file, replaced if it exists.
+    report_file (str, optional): The path to the CSV report of the av rows updated from their
+        GuidDef.
+
+    Returns:
+    None
+    '''
+    av = pd.read_csv(av_file)
+    inherit_class_values(av, report_file)
+    stat = os.stat(av_file)
+
+    tmp_file = store_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    with closing(sqlite3.connect(tmp_file)) as conn:
+        av.to_sql('av', conn, index=False)
+        conn.execute('CREATE INDEX av_guid ON av (Guid)')
+        conn.execute('CREATE TABLE av_columns (name TEXT, dtype TEXT)')
+        conn.executemany('INSERT INTO av_columns VALUES (?, ?)',
+                         [(name, str(dtype)) for name, dtype in av.dtypes.items()])
+        conn.execute('CREATE TABLE av_source (path TEXT, mtime_ns INTEGER, size INTEGER)')
+        conn.execute('INSERT INTO av_source VALUES (?, ?, ?)',
+                     (os.path.abspath(av_file), stat.st_mtime_ns, stat.st_size))
+        conn.commit()
+    os.replace(tmp_file, store_file)
+    logging.info(f"Stored {len(av)} av rows in {store_file}")
+
+def connect_av_store(store_file):
+    '''
+    Returns:
+    sqlite3.Connection: A read-only connection to the av store, several processes can read it at the
+        same time.
+    '''
+    return sqlite3.connect(pathlib.Path(store_file).absolute().as_uri() + '?mode=ro', uri=True)
+
+def is_av_store_current(av_file, store_file):
+    '''
+    Returns:
+    bool: True if the av store exists and was built from the current version of the av file.
+    '''
+    if not os.path.exists(store_file):
+        return False
+    stat = os.stat(av_file)
+    try:
+        with closing(connect_av_store(store_file)) as conn:
+            source = conn.execute('SELECT path, mtime_ns, size FROM av_source').fetchone()
+    except sqlite3.Error:
+        return False
+    return source == (os.path.abspath(av_file), stat.st_mtime_ns, stat.st_size)
+
+def query_av_store(conn, guids, dtypes):
+    '''
+    This function reads the av rows of the given Guid from the av store.
+
+    Parameters:
+    conn (sqlite3.Connection): The connection to the av store.
+    guids (Series): The Guid to look up.
+    dtypes (dict): The types of the av columns, as stored by build_av_store.
+
+    Returns:
+    DataFrame: The av rows, in the order of the av file, with the types of the av data.
+    '''
+    guids = guids.dropna().unique().tolist()
+    frames = []
+    for i in range(0, len(guids), MAX_QUERY_GUIDS):
+        batch = guids[i:i + MAX_QUERY_GUIDS]
+        query = f'SELECT * FROM av WHERE Guid IN ({", ".join("?" * len(batch))}) ORDER BY rowid'
+        frames.append(pd.read_sql_query(query, conn, params=batch))
+    if not frames:
+        frames.append(pd.read_sql_query('SELECT * FROM av LIMIT 0', conn))
+    av = pd.concat(frames, ignore_index=True)
+    for name, dtype in dtypes.items():
+        # a query result may have no missing value where the whole column has some
+        if dtype.startswith('float'):
+            av[name] = av[name].astype(float)
+        elif dtype == 'bool':
+            av[name] = av[name].astype(bool)
+    return av
+
+def stored_guids(conn, guids):
+    '''
+    Returns:
+    list: The given Guid which have rows in the av store.
+    '''
+    guids = guids.dropna().unique().tolist()
+    found = []
+    for i in range(0, len(guids), MAX_QUERY_GUIDS):
+        batch = guids[i:i + MAX_QUERY_GUIDS]
+        query = f'SELECT DISTINCT Guid FROM av WHERE Guid IN ({", ".join("?" * len(batch))})'
+        found.extend(guid for guid, in conn.execute(query, batch))
+    return found
+
+def check_campaign(utest_file, store_file, output_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    This function checks a utest file like process_csv_chunked, looking up the av rows of each chunk
+    in the av store instead of loading and resolving the av file.
+
+    Parameters:
+    utest_file (str): The path to the utest CSV file.
+    store_file (str): The path to the av store, see build_av_store.
+    output_file (str): The path to the output CSV file.
+    chunk_size (int): The number of utest rows checked at once.
+
+    Returns:
+    None
+    '''
+    with closing(connect_av_store(store_file)) as conn:
+        av_dtypes = dict(conn.execute('SELECT name, dtype FROM av_columns').fetchall())
+        dtypes, missing = scan_utest(utest_file, chunk_size,
+                                     lambda guids: guids.isin(stored_guids(conn, guids)))
+        write_chunks(utest_file, output_file, chunk_size, dtypes,
+                     lambda utest: av_lookup(query_av_store(conn, utest['GUID'], av_dtypes),
+                                             missing))
+
+def check_campaigns(utest_files, av_file, store_file, output_files, chunk_size=DEFAULT_CHUNK_SIZE,
+                    jobs=1, report_file=None):
+    '''
+    This function checks several utest files against the same av data, kept in an av store which is
+    only built when it does not exist or when the av file changed. The utest files are checked in
+    parallel.
+
+    Parameters:
+    utest_files (list of str): The paths to the utest CSV files.
+    av_file (str): The path to the av CSV file.
+    store_file (str): The path to the av store.
+    output_files (list of str): The paths to the output CSV files, one per utest file.
+    chunk_size (int): The number of utest rows checked at once.
+    jobs (int): The number of utest files checked at the same time.
+    report_file (str, optional): The path to the CSV report of the av rows updated from their
+        GuidDef, written when the av store is built.
+
+    Returns:
+    None
+    '''
+    if is_av_store_current(av_file, store_file):
+        logging.info(f"Using av store {store_file}")
     else:
-        print(merged)
+        build_av_store(av_file, store_file, report_file)
+
+    tasks = [(utest_file, store_file, output_file, chunk_size)
+             for utest_file, output_file in zip(utest_files, output_files)]
+    if jobs > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            pool.starmap(check_campaign, tasks)
+    else:
+        for task in tasks:
+            check_campaign(*task)
 
 if __name__ == "__main__":
     # Define command line arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument("utest_file", help="The path to the first CSV file.")
+    parser.add_argument("utest_files", nargs='+',
+                        help="The paths to the first CSV files, several files require --store.")
     parser.add_argument("av_file", help="The path to the second CSV file.")
-    parser.add_argument("-o", "--output", help="The path to the output CSV file. If not provided, the result is printed to the console.")
+    parser.add_argument("-o", "--output",
+                        help="The path to the output CSV file, the output directory with several "
+                             "utest files. If not provided, the result is printed to the console.")
+    parser.add_argument("-r", "--report",
+                        help="The path to a CSV file reporting the av rows updated from their "
+                             "GuidDef, before and after the update.")
+    parser.add_argument("-c", "--chunk-size", type=int,
+                        help="Read the utest file by chunks of this number of rows, the output "
+                             "file is required.")
+    parser.add_argument("--store",
+                        help="The path to a SQLite file keeping the resolved av data, rebuilt when "
+                             "the av file changes. The utest files are checked against it, the "
+                             "output is required.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="With --store, the number of utest files checked at the same time.")
     parser.add_argument("-s", "--stop", action='store_true', help="If set, the script stops after processing the av_file and writes the result into the output_file.")
 
     # Parse command line arguments
     args = parser.parse_args()
+    if len(args.utest_files) > 1 and not (args.store and not args.stop):
+        parser.error("several utest files require --store")
 
     # Run the function with the provided arguments
-    process_csv(args.utest_file, args.av_file, args.output, args.stop)
+    if args.store and not args.stop:
+        if not args.output:
+            parser.error("--store requires an output file")
+        if len(args.utest_files) > 1:
+            os.makedirs(args.output, exist_ok=True)
+            output_files = [os.path.join(args.output, os.path.basename(utest_file))
+                            for utest_file in args.utest_files]
+        else:
+            output_files = [args.output]
+        check_campaigns(args.utest_files, args.av_file, args.store, output_files,
+                        args.chunk_size or DEFAULT_CHUNK_SIZE, args.jobs, args.report)
+    elif args.chunk_size and not args.stop:
+        if not args.output:
+            parser.error("--chunk-size requires an output file")
+        process_csv_chunked(args.utest_files[0], args.av_file, args.output, args.chunk_size,
+                            args.report)
+    else:
+        process_csv(args.utest_files[0], args.av_file, args.output, args.stop, args.report)
@@ -1,85 +1,55 @@
+"""
+Write the AFDX ports of ICD files to a CSV file.
+
+The script uses xmlpipeline, at the root of the repository:
+
+    python sandbox/icd2csv.py FILE... [-o OUTPUT]
+    python -m sandbox.icd2csv FILE... [-o OUTPUT]
+
+The exit status is 1 if some files could not be parsed.
+"""
 import csv
-import xml.etree.ElementTree as ET
 import argparse
+import os
+import sys
 
-def parse_xml(file_path):
-    """
-    Parse le fichier XML.
-    
-    Args:
-        file_path (str): Le chemin du fichier XML à analyser.
-
-    Returns:
-        ElementTree.Element: La racine de l'arbre XML.
-    """
-    tree = ET.parse(file_path)
-    return tree.getroot()
+try:
+    from xmlpipeline import AFDXPortExtractor, Pipeline
+except ImportError:
+    # run as a script, the repository root is not on sys.path
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from xmlpipeline import AFDXPortExtractor, Pipeline
 
-def extract_data(root):
+def extract_data(xml_files, sink):
     """
-    A generator function that extracts the desired data from the XML file.
+    Extracts the AFDX ports of the XML files in a single streaming pass.
 
     Args:
-        root (xml.etree.ElementTree.Element): The root element of the XML file.
+        xml_files (list of str): The paths to the XML files.
+        sink (callable): Called with a dictionary containing the desired data
+            of each port, as soon as its data container ends.
 
-    Yields:
-        A dictionary containing the desired data.
+    Returns:
+        int: The number of files which could not be parsed.
     """
-    #ns = {'ate': 'http://fr.alyotech.ate/ATE/'}
-    for bus in root.iter('bus'):
-        for channel in bus.iter('channels'):
-            for dataContainer in channel.iter('dataContainers'):
-                parent_name = dataContainer.attrib['name']
-                for attr in dataContainer.iter('attributes'):
-                    if attr.attrib['name'] == 'Direction':
-                        direction = attr.attrib['value']
-                        break
-                for sublist in dataContainer.iter('sublists'):
-                    sublist_type = sublist.attrib['type']
-                    if sublist_type in ["AFDX+Sampling Port", "AFDX+Queuing Port", "AFDX+SAP Port"]:
-                        sublist_name = sublist.attrib['name']
-                        guid = sublist.find('configs').attrib['value']
-                        rate = None
-                        for attr in sublist.iter('attributes'):
-                            if attr.attrib['name'] == 'Rate (ms)':
-                                rate = attr.attrib['value']
-                                break
-                        yield {'Name': sublist_name, 'VLDirection': direction ,'GUID': guid, 'Rate (ms)': rate, 'Parent DataContainer': parent_name}
+    return Pipeline([AFDXPortExtractor(sink)]).run(xml_files)
 
 if __name__ == "__main__":
     # Create the argument parser
-    parser = argparse.ArgumentParser(description=extract_data.__doc__)
+    parser = argparse.ArgumentParser(description='Write the AFDX ports of ICD files to a CSV file.')
     parser.add_argument('xml_files', nargs='+', help='The paths to the XML files.')
     parser.add_argument('-o', '--output', help='The path to the output CSV file.')
 
     # Parse the arguments
     args = parser.parse_args()
 
-    # Initialize an empty list to hold all data from all files
-    all_data = []
-
-    # Loop over each XML file
-    for xml_file in args.xml_files:
-        # Parse the XML file
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        # Get the data from the XML file
-        data = extract_data(root)
-
-        # Add the data from this file to the overall data
-        all_data.extend(data)
-
     if args.output:
         # If an output file was specified, write the data to it
         with open(args.output, 'w', newline='') as csvfile:
-            fieldnames = ['Name', 'VLDirection', 'GUID', 'Rate (ms)', 'Parent DataContainer']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.DictWriter(csvfile, fieldnames=AFDXPortExtractor.FIELDNAMES)
             writer.writeheader()
-            for row in all_data:
-                writer.writerow(row)
+            errors = extract_data(args.xml_files, writer.writerow)
     else:
         # Otherwise, print the data to the console
-        for row in all_data:
-            print(row)
-
+        errors = extract_data(args.xml_files, print)
+    sys.exit(1 if errors else 0)
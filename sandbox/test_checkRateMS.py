@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkRateMS.py')
+
+AV = '''Guid,GuidDef,FileName,Direction,SamplePeriod,RefreshPeriod
+C1,,c.xml,Tx,10,20
+I1,C1,f1.xml,Rx,40,40
+I2,,f2.xml,Tx,40,80
+I3,,f3.xml,Rx,0,20
+'''
+
+UTEST = '''Name,GUID,Rate (ms)
+N0,I1,10
+N1,I2,40
+N2,I3,0
+N3,I2,20
+N4,I1,20
+'''
+
+
+class TestCheckRateMSModes(unittest.TestCase):
+    """The chunked and store modes write the output of the default mode"""
+
+    def run_script(self, *args):
+        subprocess.run([sys.executable, SCRIPT] + list(args), check=True, capture_output=True)
+
+    def check_modes(self, utest):
+        with tempfile.TemporaryDirectory() as tmp:
+            utest_file = os.path.join(tmp, 'utest.csv')
+            av_file = os.path.join(tmp, 'av.csv')
+            with open(utest_file, 'w') as f:
+                f.write(utest)
+            with open(av_file, 'w') as f:
+                f.write(AV)
+
+            outputs = {}
+            for mode, args in [('default', []),
+                               ('chunked', ['-c', '2']),
+                               ('store', ['-c', '2', '--store', os.path.join(tmp, 'av.db')])]:
+                output_file = os.path.join(tmp, mode + '.csv')
+                self.run_script(utest_file, av_file, '-o', output_file, *args)
+                with open(output_file) as f:
+                    outputs[mode] = f.read()
+
+            self.assertIn('N0,I1,10,', outputs['default'])
+            self.assertEqual(outputs['chunked'], outputs['default'])
+            self.assertEqual(outputs['store'], outputs['default'])
+
+    def test_integer_rates(self):
+        self.check_modes(UTEST)
+
+    def test_integer_rates_not_found(self):
+        # the periods of the whole merge are floats, the last chunk alone is found
+        self.check_modes(UTEST + 'N5,X9,10\nN6,I1,10\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
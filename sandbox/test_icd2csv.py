@@ -0,0 +1,62 @@
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'icd2csv.py')
+
+ICD = '''<?xml version="1.0" encoding="UTF-8"?>
+<ate:ICD xmlns:ate="http://fr.alyotech.ate/ATE/">
+  <bus>
+    <channels name="CH0" type="AFDX">
+      <dataContainers name="VL0" type="AFDX+VL">
+        <attributes name="Direction" value="Tx"/>
+        <sublists name="P0" type="AFDX+Sampling Port">
+          <configs property="GUID" value="GP0"/>
+          <attributes name="Rate (ms)" value="10"/>
+        </sublists>
+      </dataContainers>
+    </channels>
+  </bus>
+</ate:ICD>
+'''
+
+
+class TestICD2CSV(unittest.TestCase):
+    """The script runs from any directory and reports the files it could not parse"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.icd = os.path.join(self.tmp, 'sample.ate')
+        with open(self.icd, 'w') as f:
+            f.write(ICD)
+        self.output = os.path.join(self.tmp, 'ports.csv')
+
+    def run_script(self, *args):
+        return subprocess.run([sys.executable, SCRIPT, '-o', self.output] + list(args),
+                              cwd=self.tmp, capture_output=True)
+
+    def test_direct_invocation(self):
+        res = self.run_script(self.icd)
+        self.assertEqual(res.returncode, 0, res.stderr)
+        with open(self.output, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([(row['Name'], row['VLDirection'], row['GUID'], row['Rate (ms)'])
+                          for row in rows], [('P0', 'Tx', 'GP0', '10')])
+
+    def test_parse_error(self):
+        malformed = os.path.join(self.tmp, 'malformed.ate')
+        with open(malformed, 'w') as f:
+            f.write('<ICD><bus>')
+        res = self.run_script(self.icd, malformed)
+        self.assertEqual(res.returncode, 1)
+        with open(self.output, newline='') as f:
+            self.assertEqual(len(list(csv.DictReader(f))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
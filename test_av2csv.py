@@ -0,0 +1,160 @@
+import csv
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from unittest import mock
+
+import av2csv
+from av2csv import IncrementalExport, extract_data, extract_file, iter_rows, write_csv
+from portscan import iter_ports
+
+ATTRIBUTES = ['Name', 'Size', 'Period']
+
+XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<AV>
+  <Partition Name="PART0">
+    <HFSamplingPort Name="SP0" Size="64" Period="20"/>
+    <HFQueuingPort Name="QP0" Size="8">
+      <HFSamplingPort Name="SP1" Period="&lt;50&gt;"/>
+    </HFQueuingPort>
+    <Other Name="O0" Size="1"/>
+  </Partition>
+  <HFSamplingPort Name="SP&#233;2" Size="" Extra="x"/>
+</AV>
+'''
+
+
+def baseline_extract(xml_file, attributes):
+    """The extraction of av2csv before portscan: ElementTree parse of the
+    whole file and iteration over its elements"""
+    root = ET.parse(xml_file).getroot()
+    for port in root.iter():
+        if port.tag in ['HFSamplingPort', 'HFQueuingPort']:
+            yield {attr: port.attrib.get(attr, '') for attr in attributes}
+
+
+class TestExtractData(unittest.TestCase):
+    """extract_data gives the rows of the ElementTree extraction"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_same_rows(self):
+        xml_file = self.write('ports.xml', XML)
+        expected = list(baseline_extract(xml_file, ATTRIBUTES))
+        self.assertEqual([row['Name'] for row in expected], ['SP0', 'QP0', 'SP1', 'SP\xe92'])
+        self.assertEqual(list(extract_data(xml_file, ATTRIBUTES)), expected)
+        self.assertEqual(list(extract_data(xml_file, [])), [{}] * 4)
+
+    def test_chunks(self):
+        xml_file = self.write('ports.xml', XML)
+        expected = [port.attrib for port in ET.parse(xml_file).getroot().iter()
+                    if port.tag in ['HFSamplingPort', 'HFQueuingPort']]
+        for chunk_size in (1, 7, 100):
+            self.assertEqual(list(iter_ports(xml_file, chunk_size=chunk_size)), expected)
+
+    def test_malformed(self):
+        # the ports before the error are not exported either
+        xml_file = self.write('malformed.xml', XML.replace('</AV>', '</Partition>'))
+        with self.assertRaises(ET.ParseError):
+            list(baseline_extract(xml_file, ATTRIBUTES))
+        with self.assertRaises(ET.ParseError):
+            list(extract_data(xml_file, ATTRIBUTES))
+        path, rows, error = extract_file(xml_file, ATTRIBUTES)
+        self.assertEqual((path, rows), (xml_file, []))
+        self.assertTrue(error.startswith('ParseError: '))
+
+    def test_missing_file(self):
+        xml_file = os.path.join(self.tmp, 'missing.xml')
+        path, rows, error = extract_file(xml_file, ATTRIBUTES)
+        self.assertEqual(rows, [])
+        self.assertTrue(error.startswith('FileNotFoundError: '))
+
+
+class TestIncrementalExport(unittest.TestCase):
+    """An incremental export only extracts the new and modified files and
+    writes the CSV file of a full export"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.xml_files = [self.write(f'ports{i}.xml', XML.replace('PART0', f'PART{i}'))
+                          for i in range(3)]
+        self.csv_file = os.path.join(self.tmp, 'ports.csv')
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def update(self, attributes=ATTRIBUTES):
+        """Run an incremental export of the existing XML files
+        Returns: the extracted files
+        """
+        xml_files = [path for path in self.xml_files if os.path.exists(path)]
+        with mock.patch.object(av2csv, 'extract_file', wraps=extract_file) as extract:
+            IncrementalExport(self.csv_file, attributes).update(xml_files)
+        # same output as a full export
+        full_csv = os.path.join(self.tmp, 'full.csv')
+        write_csv(iter_rows(xml_files, attributes), full_csv, attributes)
+        with open(self.csv_file, newline='') as f, open(full_csv, newline='') as full:
+            self.assertEqual(f.read(), full.read())
+        return [c.args[0] for c in extract.call_args_list]
+
+    def rows(self):
+        with open(self.csv_file, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_unchanged(self):
+        self.assertEqual(self.update(), self.xml_files)
+        self.assertEqual(len(self.rows()), 12)
+        self.assertEqual(self.update(), [])
+        # a file touched but not modified is hashed, not extracted
+        stat = os.stat(self.xml_files[1])
+        os.utime(self.xml_files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(self.update(), [])
+        self.assertEqual(len(self.rows()), 12)
+
+    def test_modified(self):
+        self.update()
+        self.write('ports1.xml', XML.replace('SP0', 'SP0 modified'))
+        self.assertEqual(self.update(), [self.xml_files[1]])
+        self.assertEqual([row['Name'] for row in self.rows()][4:8],
+                         ['SP0 modified', 'QP0', 'SP1', 'SP\xe92'])
+
+    def test_deleted(self):
+        self.update()
+        os.remove(self.xml_files[0])
+        self.assertEqual(self.update(), [])
+        self.assertEqual(len(self.rows()), 8)
+        self.assertNotIn(self.xml_files[0], {row['FileName'] for row in self.rows()})
+        self.assertEqual(len(os.listdir(self.csv_file + '.d')), 3)
+
+    def test_malformed(self):
+        self.update()
+        self.write('ports2.xml', XML.replace('</AV>', ''))
+        self.assertEqual(self.update(), [self.xml_files[2]])
+        self.assertEqual(len(self.rows()), 8)
+
+    def test_attributes_changed(self):
+        self.update()
+        attributes = ['Name', 'Extra']
+        self.assertEqual(self.update(attributes), self.xml_files)
+        self.assertEqual(list(self.rows()[-1]), ['BaseName', 'Name', 'Extra', 'FileName'])
+        self.assertEqual(self.rows()[-1]['Extra'], 'x')
+        self.assertEqual(self.update(attributes), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import closing
+
+from guidindex import GUIDIndex
+from xmlpipeline import AFDXPortExtractor, Pipeline
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'guidindex.py')
+
+ICD = '''<?xml version="1.0" encoding="UTF-8"?>
+<ate:ICD xmlns:ate="http://fr.alyotech.ate/ATE/">
+  <bus>
+    <channels name="CH0" type="AFDX">
+      <configs property="Label" value="LC0"/>
+      <configs property="GUID" value="G0"/>
+      <dataContainers name="VL0" type="AFDX+VL">
+        <attributes name="Direction" value="Tx"/>
+        <sublists name="P0" type="AFDX+Sampling Port">
+          <configs property="Label" value="LP0"/>
+          <configs property="GUID" value="GP0"/>
+        </sublists>
+        <sublists name="P1" type="AFDX+Queuing Port">
+          <configs value="GP1"/>
+        </sublists>
+        <sublists name="P2" type="Other">
+          <configs value="GP2"/>
+        </sublists>
+      </dataContainers>
+    </channels>
+    <datas name="D0" type="INT">
+      <configs property="Label" value="L0"/>
+      <configs property="GUID" value="DG0"/>
+    </datas>
+  </bus>
+</ate:ICD>
+'''
+
+
+class TestGUIDRule(unittest.TestCase):
+    """The GUID of an element is its 'GUID' configs, the first configs without
+    property for the AFDX port sublists only"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.icd = os.path.join(self.tmp, 'sample.ate')
+        with open(self.icd, 'w', encoding='utf-8') as f:
+            f.write(ICD)
+        self.index_file = os.path.join(self.tmp, 'index.db')
+        with closing(GUIDIndex(self.index_file)) as index:
+            self.assertEqual(index.update([self.icd]), 0)
+
+    def lookup(self, guid=None, name=None):
+        with closing(GUIDIndex(self.index_file)) as index:
+            return [(e['kind'], e['name'], e['guid']) for e in index.lookup(guid, name)]
+
+    def test_guid_configs_after_an_other_property(self):
+        self.assertEqual(self.lookup('DG0'), [('datas', 'D0', 'DG0')])
+        self.assertEqual(self.lookup('G0'), [('channels', 'CH0', 'G0')])
+        self.assertEqual(self.lookup('GP0'), [('sublists', 'P0', 'GP0')])
+        self.assertEqual(self.lookup('L0'), [])
+
+    def test_afdx_port_without_property(self):
+        self.assertEqual(self.lookup('GP1'), [('sublists', 'P1', 'GP1')])
+        # only the AFDX ports fall back to the configs without property
+        self.assertEqual(self.lookup(name='P2'), [('sublists', 'P2', None)])
+
+    def test_command_line(self):
+        res = subprocess.run([sys.executable, SCRIPT, self.index_file, '-g', 'DG0'],
+                             check=True, capture_output=True, text=True)
+        lines = res.stdout.splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0].split('\t')[1:4], ['ICD/bus/datas[D0]', 'datas', 'DG0'])
+
+    def test_afdx_extractor(self):
+        rows = []
+        Pipeline([AFDXPortExtractor(rows.append)]).parse_file(self.icd)
+        self.assertEqual([(row['Name'], row['GUID']) for row in rows],
+                         [('P0', 'GP0'), ('P1', 'GP1')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,365 @@
+"""
+Parse XML files once and fan their elements out to several extractors
+
+Each file is fed by chunks to an expat parser, as in portscan, whose target
+forwards the start and the end of every element to all the extractors of
+the pipeline. An extractor keeps what it needs from this element stream and
+writes its results to its own sink, any callable taking one result (the
+writerow method of a csv writer, print, the append method of a list...).
+
+Results of a file which fails to parse are dropped, except the AFDX rows of
+the data containers already complete.
+"""
+import argparse
+import csv
+import logging
+import os
+import xml.etree.ElementTree as ET
+
+from portscan import PORT_TAGS, CHUNK_SIZE
+
+
+# sublist types of the AFDX ports
+AFDX_PORT_TYPES = ("AFDX+Sampling Port", "AFDX+Queuing Port", "AFDX+SAP Port")
+
+# GUID state of an element without configs child, see element_guid
+NO_GUID = (None, False)
+
+
+def element_guid(guid, tag, attrib, afdx_port=False):
+    """Apply the GUID rule of the ICD files to a child element: the GUID of
+    an element is the value of its first configs child whose property is
+    'GUID'. The GUID configs of the AFDX port sublists may have no property:
+    a sublist without 'GUID' configs takes the value of its first configs
+    child without property.
+
+    Args:
+        guid (tuple): The GUID of the parent element found so far and True
+            if it comes from a 'GUID' configs, NO_GUID if there is none yet.
+        tag (str): The tag of the child element.
+        attrib (dict): The attributes of the child element.
+        afdx_port (bool): True if the parent element is an AFDX port sublist.
+
+    Returns:
+        tuple: The GUID of the parent element, in the form of guid.
+    """
+    if tag != 'configs' or guid[1]:
+        return guid
+    if attrib.get('property') == 'GUID':
+        return attrib.get('value'), True
+    if afdx_port and guid[0] is None and 'property' not in attrib:
+        return attrib.get('value'), False
+    return guid
+
+
+class Extractor(object):
+    """Base class of the extractors, the methods are called in this order:
+    begin_file, start and end of each element, end_file or abort_file, and
+    close once all the files are parsed."""
+
+    def begin_file(self, file_path):
+        pass
+
+    def start(self, tag, attrib):
+        pass
+
+    def end(self, tag):
+        pass
+
+    def end_file(self, file_path):
+        pass
+
+    def abort_file(self, file_path):
+        """Called instead of end_file when the file cannot be parsed"""
+        pass
+
+    def close(self):
+        pass
+
+
+class PortRowsExtractor(Extractor):
+    """Rows of the HFSamplingPort and HFQueuingPort elements, see av2csv"""
+
+    def __init__(self, attributes, sink):
+        """
+        Args:
+            attributes (list of str): The attributes to extract.
+            sink (callable): Called with each row, a dictionary whose keys are
+                av2csv.get_fieldnames(attributes).
+        """
+        self.attributes = attributes
+        self.sink = sink
+        self.rows = []
+        self.file_path = None
+        self.base_name = None
+
+    def begin_file(self, file_path):
+        self.file_path = file_path
+        self.base_name = os.path.basename(file_path)
+        self.rows = []
+
+    def start(self, tag, attrib):
+        if tag in PORT_TAGS:
+            data = {attr: attrib.get(attr, '') for attr in self.attributes}
+            self.rows.append({**{'BaseName': self.base_name}, **data,
+                              **{'FileName': self.file_path}})
+
+    def end_file(self, file_path):
+        for row in self.rows:
+            self.sink(row)
+        self.rows = []
+
+    def abort_file(self, file_path):
+        self.rows = []
+
+
+class AttributeNamesExtractor(Extractor):
+    """Attribute names of the HFSamplingPort and HFQueuingPort elements, see
+    avFields"""
+
+    def __init__(self, sink):
+        """
+        Args:
+            sink (callable): Called with each attribute name, in sorted order,
+                once all the files are parsed.
+        """
+        self.sink = sink
+        self.names = set()
+        self.file_names = set()
+
+    def begin_file(self, file_path):
+        self.file_names = set()
+
+    def start(self, tag, attrib):
+        if tag in PORT_TAGS:
+            self.file_names.update(attrib.keys())
+
+    def end_file(self, file_path):
+        self.names.update(self.file_names)
+
+    def close(self):
+        for name in sorted(self.names):
+            self.sink(name)
+
+
+class AFDXPortExtractor(Extractor):
+    """AFDX port sublists of the data containers of the bus channels, with
+    their GUID, rate and the direction of their virtual link, see
+    sandbox/icd2csv.py
+
+    A port is reported once, with its innermost enclosing data container:
+    - VLDirection is the value of the first 'Direction' attributes element
+      found in the container, the direction of the previous container if
+      there is none
+    - GUID is the GUID of the sublist, see element_guid
+    - Rate (ms) is the value of the first 'Rate (ms)' attributes element
+      found in the sublist
+
+    The direction may follow the ports in the container, so the rows of a
+    container are written when the container ends.
+    """
+    FIELDNAMES = ['Name', 'VLDirection', 'GUID', 'Rate (ms)', 'Parent DataContainer']
+
+    def __init__(self, sink):
+        """
+        Args:
+            sink (callable): Called with each row, a dictionary whose keys
+                are FIELDNAMES.
+        """
+        self.sink = sink
+        self.begin_file(None)
+
+    def begin_file(self, file_path):
+        self.depth = 0
+        self.bus_depth = 0
+        self.channel_depth = 0
+        # open data containers: [depth, name, direction, rows]
+        self.containers = []
+        # open AFDX port sublists: (depth, row)
+        self.sublists = []
+        # direction of the last complete container
+        self.direction = None
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        if tag == 'bus':
+            self.bus_depth += 1
+        elif tag == 'channels':
+            if self.bus_depth:
+                self.channel_depth += 1
+        elif tag == 'dataContainers':
+            if self.channel_depth:
+                self.containers.append([self.depth, attrib.get('name'), None, []])
+        elif not self.containers:
+            return
+        elif tag == 'sublists':
+            if attrib.get('type') in AFDX_PORT_TYPES:
+                row = {'Name': attrib.get('name'), 'GUID': NO_GUID,
+                       'Parent DataContainer': self.containers[-1][1]}
+                self.sublists.append((self.depth, row))
+                self.containers[-1][3].append(row)
+        elif tag == 'configs':
+            if self.sublists:
+                depth, row = self.sublists[-1]
+                if depth == self.depth - 1:
+                    row['GUID'] = element_guid(row['GUID'], tag, attrib, afdx_port=True)
+        elif tag == 'attributes':
+            name = attrib.get('name')
+            if name == 'Direction':
+                for container in self.containers:
+                    if container[2] is None:
+                        container[2] = attrib.get('value')
+            elif name == 'Rate (ms)':
+                for _, row in self.sublists:
+                    if 'Rate (ms)' not in row:
+                        row['Rate (ms)'] = attrib.get('value')
+
+    def end(self, tag):
+        if tag == 'bus':
+            self.bus_depth -= 1
+        elif tag == 'channels':
+            if self.bus_depth:
+                self.channel_depth -= 1
+        elif tag == 'dataContainers':
+            if self.containers and self.containers[-1][0] == self.depth:
+                _, _, direction, rows = self.containers.pop()
+                if direction is None:
+                    direction = self.direction
+                self.direction = direction
+                for row in rows:
+                    self.sink({'Name': row['Name'], 'VLDirection': direction,
+                               'GUID': row['GUID'][0], 'Rate (ms)': row.get('Rate (ms)'),
+                               'Parent DataContainer': row['Parent DataContainer']})
+        elif tag == 'sublists':
+            if self.sublists and self.sublists[-1][0] == self.depth:
+                self.sublists.pop()
+        self.depth -= 1
+
+
+class Pipeline(object):
+    """Parse XML files once for several extractors"""
+
+    def __init__(self, extractors):
+        """
+        Args:
+            extractors (list of Extractor): The extractors fed by the pipeline.
+        """
+        self.extractors = list(extractors)
+        self._starts = [extractor.start for extractor in self.extractors]
+        self._ends = [extractor.end for extractor in self.extractors]
+
+    # XMLParser target interface
+    def start(self, tag, attrib):
+        for start in self._starts:
+            start(tag, attrib)
+
+    def end(self, tag):
+        for end in self._ends:
+            end(tag)
+
+    def close(self):
+        pass
+
+    def parse_file(self, file_path, chunk_size=CHUNK_SIZE):
+        """
+        Feed the elements of an XML file to the extractors.
+
+        Raises:
+            xml.etree.ElementTree.ParseError: The file is not well-formed XML,
+                the extractors have been told with abort_file.
+        """
+        for extractor in self.extractors:
+            extractor.begin_file(file_path)
+        try:
+            parser = ET.XMLParser(target=self)
+            with open(file_path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    parser.feed(chunk)
+            parser.close()
+        except Exception:
+            for extractor in self.extractors:
+                extractor.abort_file(file_path)
+            raise
+        for extractor in self.extractors:
+            extractor.end_file(file_path)
+
+    def run(self, file_paths):
+        """
+        Parse XML files, logging and skipping those which cannot be parsed,
+        then close the extractors.
+
+        Returns:
+            int: The number of files which could not be parsed.
+        """
+        errors = 0
+        count = 0
+        for file_path in file_paths:
+            count += 1
+            try:
+                self.parse_file(file_path)
+            except (ET.ParseError, OSError) as e:
+                if isinstance(e, OSError) and e.filename != file_path:
+                    # raised by a sink, not by reading the file
+                    raise
+                errors += 1
+                logging.error(f'Error parsing file {count}: {file_path}: {type(e).__name__}: {e}')
+                continue
+            logging.info(f'Processed file {count}: {file_path}')
+        for extractor in self.extractors:
+            extractor.close()
+        return errors
+
+
+def csv_sink(csvfile, fieldnames):
+    """
+    Returns:
+        callable: The writerow method of a csv writer writing its header first.
+    """
+    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    writer.writeheader()
+    return writer.writerow
+
+
+if __name__ == "__main__":
+    from av2csv import BUFFER_SIZE, get_all_files, get_fieldnames
+
+    parser = argparse.ArgumentParser(
+        description="Run several extractions in a single parse of XML files.")
+    parser.add_argument('-d', '--directory', help='The path to a directory of XML files.')
+    parser.add_argument('--ports', help='Write the port rows of av2csv to this CSV file.')
+    parser.add_argument('-f', '--filter', type=str,
+                        help='The port attributes to write with --ports.')
+    parser.add_argument('--fields', help='Write the port attribute names of avFields to this file.')
+    parser.add_argument('--afdx', help='Write the AFDX port rows of icd2csv to this CSV file.')
+    parser.add_argument('xml_files', nargs='*', help='The paths to the XML files.')
+
+    args = parser.parse_args()
+    if args.ports and not args.filter:
+        parser.error('--ports requires the attributes to filter')
+
+    files = []
+    extractors = []
+    if args.ports:
+        attributes = args.filter.split(',')
+        files.append(open(args.ports, 'w', newline='', buffering=BUFFER_SIZE))
+        sink = csv_sink(files[-1], get_fieldnames(attributes))
+        extractors.append(PortRowsExtractor(attributes, sink))
+    if args.fields:
+        files.append(open(args.fields, 'w'))
+        extractors.append(AttributeNamesExtractor(lambda name, f=files[-1]: print(name, file=f)))
+    if args.afdx:
+        files.append(open(args.afdx, 'w', newline='', buffering=BUFFER_SIZE))
+        extractors.append(AFDXPortExtractor(csv_sink(files[-1], AFDXPortExtractor.FIELDNAMES)))
+
+    try:
+        if args.directory:
+            xml_files = get_all_files(args.directory)
+        else:
+            xml_files = args.xml_files
+        Pipeline(extractors).run(xml_files)
+    finally:
+        for f in files:
+            f.close()